@@ -3,10 +3,15 @@ from gi.repository import Hinawa
 from ta1394.general import AvcGeneral
 from ta1394.general import AvcConnection
 from ta1394.ccm import AvcCcm
+from ta1394.streamformat import AvcStreamFormatIndex
+from ta1394.recorder import FcpRecorder
+from ta1394.identity import AvcIdentityCache
 
 from bridgeco.extensions import BcoPlugInfo
 from bridgeco.extensions import BcoSubunitInfo
 from bridgeco.extensions import BcoStreamFormatInfo
+from bridgeco.cache import BcoTopologyCache
+from bridgeco.ranges import BcoAttributeRanges
 
 class BebobNormal(Hinawa.FwUnit):
     unit_info = {}
@@ -14,30 +19,115 @@ class BebobNormal(Hinawa.FwUnit):
     subunit_plugs = {}
     signal_destination = {}
     signal_sources = {}
+    attribute_ranges = {}
 
-    def __init__(self, path):
-        super().__init__()
-        self.open(path)
-        self.listen()
+    _info_addr = 0xffffc8020000
+    _info_fw_version_offset = 0x34
 
-        fcp = Hinawa.FwFcp()
-        fcp.listen(self)
+    # With fcp, e.g. FcpReplayer, the unit is not opened and the transactions
+    # are done with it. With capture, the transactions are recorded to the
+    # file. With cache, e.g. BcoTopologyCache, the topology of the model is
+    # loaded from the cache instead of enumeration, or saved to it, for the
+    # opened unit only since the version of firmware is read from it. With
+    # ranges, the ranges of settings in function blocks of audio subunit are
+    # gathered too, and kept in the cache.
+    def __init__(self, path, fcp=None, capture=None, cache=None,
+                 ranges=False):
+        super().__init__()
+        if fcp is None:
+            self.open(path)
+            self.listen()
+            fcp = Hinawa.FwFcp()
+            fcp.listen(self)
+            handle = fcp
+            AvcIdentityCache.attach(fcp, self._read_guid(path), self)
+            fw_version = self._read_fw_version()
+        else:
+            handle = None
+            fw_version = None
+        if capture is not None:
+            fcp = FcpRecorder(fcp, capture)
 
         self.unit_info = self._parse_unit_info(fcp)
-        self.unit_plugs = self._parse_unit_plugs(fcp)
 
-        self.subunit_plugs = self._parse_subunit_plugs(fcp)
+        key = None
+        topology = None
+        changed = False
+        if cache is not None:
+            key = BcoTopologyCache.get_key(path, fw_version)
+        if key is not None:
+            topology = cache.load(key)
+            if topology is not None and cache.verify_entry and \
+               not BcoTopologyCache.verify(fcp, topology):
+                cache.invalidate(key)
+                topology = None
+
+        if topology is not None:
+            self.unit_plugs = topology['unit-plugs']
+            self.subunit_plugs = topology['subunit-plugs']
+            self.function_block_plugs = topology['function-block-plugs']
+            raw_formats = topology['stream-formats']
+        else:
+            self.unit_plugs = self._parse_unit_plugs(fcp)
+            self.subunit_plugs = self._parse_subunit_plugs(fcp)
+            self.function_block_plugs = self._parse_function_block_plugs(fcp)
+            raw_formats = self._parse_stream_formats(fcp)
+            topology = {
+                'unit-plugs':           self.unit_plugs,
+                'subunit-plugs':        self.subunit_plugs,
+                'function-block-plugs': self.function_block_plugs,
+                'stream-formats':       raw_formats,
+            }
+            changed = True
+
+        if ranges:
+            if 'attribute-ranges' not in topology:
+                topology['attribute-ranges'] = \
+                                        self._parse_attribute_ranges(fcp)
+                changed = True
+            self.attribute_ranges = topology['attribute-ranges']
 
-        self.function_block_plugs = self._parse_function_block_plugs(fcp)
+        if key is not None and changed:
+            # The cache is just for speed.
+            try:
+                cache.save(key, topology)
+            except OSError:
+                pass
 
-        self.stream_formats = self._parse_stream_formats(fcp)
+        self.stream_formats = BcoTopologyCache.parse_stream_formats(raw_formats)
+        self.stream_format_index = \
+                            AvcStreamFormatIndex.build(self.stream_formats)
 
         self.signal_destination = self._parse_signal_destination(fcp)
         self.signal_sources = self._parse_signal_sources(fcp)
 
-        fcp.unlisten()
+        if capture is not None:
+            fcp.close()
+        if handle is not None:
+            handle.unlisten()
         del fcp
 
+    # Linux FireWire subsystem exposes GUID of the node in sysfs.
+    @staticmethod
+    def _read_guid(path):
+        name = path.split('/')[-1]
+        try:
+            with open('/sys/bus/firewire/devices/{0}/guid'.format(name)) as f:
+                return int(f.read(), 16)
+        except (OSError, ValueError):
+            return None
+
+    # BeBoB firmware exposes its information in little endian, as snd-bebob
+    # reads. The cache is not used when it is not available.
+    def _read_fw_version(self):
+        try:
+            req = Hinawa.FwReq()
+            quads = req.read(self, BebobNormal._info_addr +
+                                   BebobNormal._info_fw_version_offset, 1)
+        except Exception:
+            return None
+        return int.from_bytes(quads[0].to_bytes(4, 'big'), 'little')
+
     def _parse_unit_info(self, fcp):
         return AvcGeneral.get_unit_info(fcp) 
 
@@ -129,7 +219,6 @@ class BebobNormal(Hinawa.FwUnit):
 
     def _parse_function_block_plugs(self, fcp):
         fbs = {}
-        subunits = BcoSubunitInfo.get_subunits(fcp)
         for type in self.subunit_plugs.keys():
             subunit_fbs = {}
             entries = []
@@ -189,6 +278,17 @@ class BebobNormal(Hinawa.FwUnit):
             pass
         return plug
 
+    # The number of channels of feature function blocks is of their input.
+    def _parse_attribute_ranges(self, fcp):
+        if 'audio' not in self.subunit_plugs:
+            return {}
+        channels = {}
+        for fb_id, plugs in enumerate(
+                        self.function_block_plugs['audio'].get(0x81, [])):
+            if len(plugs['input']) > 0:
+                channels[fb_id + 1] = len(plugs['input'][0]['channels'])
+        return BcoAttributeRanges.prefetch(fcp, 0, channels)
+
     def _parse_signal_destination(self, fcp):
         dst = []
         for i, plug in enumerate(self.subunit_plugs['music']['input']):
@@ -215,14 +315,16 @@ class BebobNormal(Hinawa.FwUnit):
                 addr = AvcCcm.get_unit_signal_addr('isoc', i)
                 candidates[plug['name']] = addr
         # Inquire these are able to connect to destination.
-        for key, src in candidates.items():
-            try:
-                AvcCcm.ask_signal_source(fcp, src, self.signal_destination)
-            except:
-                continue
-            srcs[key] = src
+        if len(candidates) == 0 or len(self.signal_destination) == 0:
+            return srcs
+        results = AvcCcm.ask_signal_sources(fcp, list(candidates.values()),
+                                            self.signal_destination)
+        for (key, src), connectable in zip(candidates.items(), results):
+            if connectable:
+                srcs[key] = src
         return srcs
 
+    # Raw entries, to be parsed by BcoTopologyCache.parse_stream_formats().
     def _parse_stream_formats(self, fcp):
         hoge = {}
         for type, dir_plugs in self.unit_plugs.items():
@@ -233,6 +335,6 @@ class BebobNormal(Hinawa.FwUnit):
                 hoge[type][dir] = []
                 for i, plug in enumerate(plugs):
                     addr = BcoPlugInfo.get_unit_addr(dir, type, i)
-                    fmts = BcoStreamFormatInfo.get_entry_list(fcp, addr)
+                    fmts = BcoStreamFormatInfo.get_raw_entry_list(fcp, addr)
                     hoge[type][dir].append(fmts)
         return hoge
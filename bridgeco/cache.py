@@ -0,0 +1,128 @@
+import os
+import zlib
+from ast import literal_eval
+from random import choice
+from struct import Struct
+
+from bridgeco.extensions import BcoPlugInfo
+from bridgeco.extensions import BcoStreamFormatInfo
+
+# The topology of units is the same for the same model and firmware. It is
+# kept in a file per vendor ID, model ID and firmware version on local disk.
+# The file starts with magic and version, then the topology follows as
+# compressed Python literals. Stream formats are kept as raw entries and
+# parsed at loading, thus fixes of the parser apply to cached entries.
+class BcoTopologyCache():
+    magic = b'BCOT'
+    version = 1
+
+    _header = Struct('>4sB')
+
+    _keys = ('unit-plugs', 'subunit-plugs', 'function-block-plugs',
+             'stream-formats')
+    # Kept when given, e.g. the table of BcoAttributeRanges.
+    _optional_keys = ('attribute-ranges', )
+
+    # With verify, one entry of cached stream formats is compared with the
+    # device at loading.
+    def __init__(self, path=None, verify=True):
+        self.verify_entry = verify
+        if path is None:
+            path = os.environ.get('XDG_CACHE_HOME',
+                                  os.path.expanduser('~/.cache'))
+            path = os.path.join(path, 'hinawa-utils')
+        self.path = path
+
+    # Vendor ID and model ID are the entries of config ROM which Linux
+    # FireWire subsystem exposes in sysfs. The version of firmware is read
+    # from the unit by the caller, e.g. BebobNormal. Return None when any of
+    # them is not available.
+    @staticmethod
+    def get_key(path, fw_version):
+        if fw_version is None:
+            return None
+        name = path.split('/')[-1]
+        base = '/sys/bus/firewire/devices/{0}'.format(name)
+        key = []
+        for attr in ('vendor', 'model'):
+            for node in (base, base + '.0'):
+                try:
+                    with open('{0}/{1}'.format(node, attr)) as f:
+                        key.append(int(f.read(), 16))
+                        break
+                except (OSError, ValueError):
+                    continue
+            else:
+                return None
+        key.append(fw_version)
+        return tuple(key)
+
+    def get_path(self, key):
+        return os.path.join(self.path,
+                    'bebob-{0:06x}-{1:06x}-{2:08x}.bin'.format(*key))
+
+    # Return the topology, or None when not cached.
+    def load(self, key):
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                data = f.read()
+            magic, version = BcoTopologyCache._header.unpack_from(data, 0)
+            if magic != self.magic or version != self.version:
+                return None
+            topology = literal_eval(zlib.decompress(
+                        data[BcoTopologyCache._header.size:]).decode())
+        except (OSError, ValueError, SyntaxError, zlib.error):
+            return None
+        if not all(name in topology for name in BcoTopologyCache._keys):
+            return None
+        return topology
+
+    def save(self, key, topology):
+        data = repr({name: topology[name]
+                     for name in BcoTopologyCache._keys +
+                                 BcoTopologyCache._optional_keys
+                     if name in topology})
+        os.makedirs(self.path, exist_ok=True)
+        # Replace at once so that the other processes never read a part.
+        path = self.get_path(key)
+        tmp = '{0}.{1}'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(BcoTopologyCache._header.pack(self.magic, self.version))
+            f.write(zlib.compress(data.encode()))
+        os.replace(tmp, path)
+
+    def invalidate(self, key):
+        try:
+            os.remove(self.get_path(key))
+        except FileNotFoundError:
+            pass
+
+    # Raw entries keyed by type and direction of unit plug.
+    @staticmethod
+    def parse_stream_formats(raw_formats):
+        formats = {}
+        for type, dir_plugs in raw_formats.items():
+            formats[type] = {}
+            for dir, plugs in dir_plugs.items():
+                formats[type][dir] = []
+                for entries in plugs:
+                    formats[type][dir].append(
+                        [BcoStreamFormatInfo._parse_format(entry)
+                         for entry in entries])
+        return formats
+
+    # Compare one entry chosen at random with the device, to detect a cache
+    # file left by the other configuration of the same firmware.
+    @staticmethod
+    def verify(fcp, topology):
+        candidates = []
+        for type, dir_plugs in topology['stream-formats'].items():
+            for dir, plugs in dir_plugs.items():
+                for i, entries in enumerate(plugs):
+                    for j, entry in enumerate(entries):
+                        candidates.append((type, dir, i, j, entry))
+        if len(candidates) == 0:
+            return True
+        type, dir, plug, index, entry = choice(candidates)
+        addr = BcoPlugInfo.get_unit_addr(dir, type, plug)
+        return BcoStreamFormatInfo.get_entry(fcp, addr, index) == entry
@@ -1,7 +1,8 @@
 from ta1394.general import AvcGeneral
+from ta1394.transport import AvcTransport
 from ta1394.streamformat import AvcStreamFormatInfo
-
-import time
+from ta1394.streamformat import AvcStreamFormat
+from ta1394.identity import AvcIdentityCache
 
 class BcoPlugInfo():
     addr_dir  = ('input', 'output')
@@ -326,6 +327,11 @@ class BcoSubunitInfo():
 
     @staticmethod
     def get_subunits(unit):
+        return AvcIdentityCache.query(unit, ('bco-subunits', ),
+                                      BcoSubunitInfo._get_subunits)
+
+    @staticmethod
+    def _get_subunits(unit):
         args = bytearray()
         args.append(0x01)
         args.append(0xff)
@@ -540,65 +546,61 @@ class BcoStreamFormatInfo():
                   'do-not-care',    # 0xff
                   'reserved')       # the others
 
+    # Return raw data of the entry, or None when the index is out of list.
     @staticmethod
-    def get_entry_list(fcp, addr):
-        fmts = []
+    def get_entry(fcp, addr, index):
+        args = bytearray()
+        args.append(0x01)
+        args.append(addr[5])
+        args.append(0x2f)   # Bco stream format support
+        args.append(0xc1)   # List request
+        args.append(addr[0])
+        args.append(addr[1])
+        args.append(addr[2])
+        args.append(addr[3])
+        args.append(addr[4])
+        args.append(0xff)
+        args.append(index)
+        args.append(0xff)
+        params = AvcGeneral.transact(fcp, args)
+        if params[0] == 0x0a:
+            return None
+        elif params[0] != 0x0c:
+            raise OSError(AvcTransport.status_message(params))
+        return bytes(params[11:])
+
+    # DM1500 tends to cause timeout. The retry policy of the transport
+    # learns the gap between commands it needs.
+    @staticmethod
+    def get_raw_entry_list(fcp, addr):
+        entries = []
         for i in range(0xff):
-            # DM1500 tends to cause timeout.
-            time.sleep(0.1)
-            try:
-                args = bytearray()
-                args.append(0x01)
-                args.append(addr[5])
-                args.append(0x2f)   # Bco stream format support
-                args.append(0xc1)   # List request
-                args.append(addr[0])
-                args.append(addr[1])
-                args.append(addr[2])
-                args.append(addr[3])
-                args.append(addr[4])
-                args.append(0xff)
-                args.append(i)
-                args.append(0xff)
-                params = AvcGeneral.command_status(fcp, args)
-                fmts.append(BcoStreamFormatInfo._parse_format(params[11:]))
-            except OSError as e:
-                if str(e) != 'Rejected':
-                    raise
-                else:
-                    break
-        return fmts
+            entry = BcoStreamFormatInfo.get_entry(fcp, addr, i)
+            if entry is None:
+                break
+            entries.append(entry)
+        return entries
+
+    @staticmethod
+    def get_entry_list(fcp, addr):
+        return [BcoStreamFormatInfo._parse_format(entry)
+                for entry in BcoStreamFormatInfo.get_raw_entry_list(fcp, addr)]
 
     # Two types of sync stream: 0x90/0x00/0x40 and 0x90/0x40 with 'sync-stream'
     @staticmethod
     def _parse_format(params):
-        fmt = {}
         # Sync stream with stereo raw audio
         if params[0] == 0x90 and params[1] == 0x00 and params[2] == 0x40:
             ctl = params[4] & 0x01
             rate = params[4] >> 8
-            fmt['type'] = 'Sync'
-            fmt['rate-control'] = AvcStreamFormatInfo.rate_controls[ctl]
-            fmt['sampling-rate'] = AvcStreamFormatInfo.sampling_rates[rate]
-            fmt['formation'] = ['multi-bit-linear-audio-raw']
-            return fmt
+            return AvcStreamFormat.get('Sync',
+                        AvcStreamFormatInfo.sampling_rates[rate],
+                        AvcStreamFormatInfo.rate_controls[ctl],
+                        ((0x06, 1), ))
         if params[0] != 0x90 or params[1] != 0x40:
             raise RuntimeError('Unsupported format')
-        fmt['type'] = 'Compound'
-        fmt['sampling-rate'] = AvcStreamFormatInfo.sampling_rates[params[2]]
         ctl = params[3] & 0x3
-        fmt['rate-control'] = AvcStreamFormatInfo.rate_controls[ctl]
-        formation = []
-        for i in range(params[4]):
-            for c in range(params[5 + i * 2]):
-                type = params[5 + i * 2 + 1]
-                if type <= 0x0f:
-                    formation.append(BcoStreamFormatInfo.data_types[type])
-                elif type == 0x40:
-                    formation.append('sync-stream')
-                elif type == 0xff:
-                    formation.append('do-not-care')
-                else:
-                    formation.append('reserved')
-        fmt['formation'] = formation
-        return fmt
+        return AvcStreamFormat.get('Compound',
+                        AvcStreamFormatInfo.sampling_rates[params[2]],
+                        AvcStreamFormatInfo.rate_controls[ctl],
+                        AvcStreamFormat.parse_formation(params[4:]))
@@ -0,0 +1,84 @@
+from ta1394.audio import AvcAudio
+from ta1394.pipeline import AvcPipeline
+
+from bridgeco.extensions import BcoSubunitInfo
+
+# Ranges of settings in function blocks of audio subunit, gathered in one
+# sweep in pipeline. The table maps (function block type, function block ID,
+# channel, control) to (minimum, maximum, resolution, default), with None
+# for attributes which the unit doesn't report. The control is 0 for
+# selector. For processing function blocks, the channel is the input plug of
+# mixer and the range is of its first crosspoint, (1, 1), since channels of
+# mixer start at 1 as AvcMixerMatrix takes.
+class BcoAttributeRanges():
+    _attrs = ('minimum', 'maximum', 'resolution', 'default')
+
+    # Entries of all pages of function block information.
+    @staticmethod
+    def get_function_blocks(unit, subunit_id):
+        entries = []
+        for page in range(0xff):
+            try:
+                page_entries = BcoSubunitInfo.get_subunit_fb_info(unit,
+                                            'audio', subunit_id, page, 0xff)
+            except OSError:
+                break
+            if len(page_entries) == 0:
+                break
+            entries.extend(page_entries)
+        return entries
+
+    # The channels map function block ID of feature to the number of its
+    # channels. The master channel, 0, is always included.
+    @staticmethod
+    def prefetch(unit, subunit_id, channels=None):
+        if channels is None:
+            channels = {}
+        queries = []
+        for entry in BcoAttributeRanges.get_function_blocks(unit, subunit_id):
+            fb_type = entry['fb-type']
+            fb_id = entry['fb-id']
+            if fb_type == 0x80:
+                queries.append(((fb_type, fb_id, 0, 0),
+                                AvcAudio.get_selector_state, (fb_id, )))
+            elif fb_type == 0x81:
+                for ch in range(channels.get(fb_id, 0) + 1):
+                    queries.append(((fb_type, fb_id, ch,
+                                     AvcAudio._volume_control),
+                                    AvcAudio.get_feature_volume_state,
+                                    (fb_id, ch)))
+                    queries.append(((fb_type, fb_id, ch,
+                                     AvcAudio._lr_control),
+                                    AvcAudio.get_feature_lr_state,
+                                    (fb_id, ch)))
+            elif fb_type == 0x82:
+                for plug in range(entry['inputs']):
+                    queries.append(((fb_type, fb_id, plug, 0x03),
+                                    AvcAudio.get_processing_mixer_state,
+                                    (fb_id, plug, 1, 1)))
+
+        table = {}
+        pipeline = AvcPipeline.get(unit)
+        futures = []
+        for key, func, args in queries:
+            for attr in BcoAttributeRanges._attrs:
+                if func == AvcAudio.get_selector_state and \
+                   attr not in AvcAudio._selector_attributes:
+                    futures.append(None)
+                    continue
+                futures.append(pipeline.call(func, subunit_id, attr, *args))
+        for i, (key, func, args) in enumerate(queries):
+            values = []
+            for future in futures[i * 4:i * 4 + 4]:
+                values.append(BcoAttributeRanges._get_result(future))
+            table[key] = tuple(values)
+        return table
+
+    @staticmethod
+    def _get_result(future):
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except OSError:
+            return None
@@ -0,0 +1,149 @@
+from heapq import heappush
+from heapq import heappop
+from math import cos
+from math import pi
+from time import monotonic
+from time import sleep
+
+from ta1394.audio import AvcAudio
+
+# Volume of AV/C feature function block, in 1/256 dB as signed 16 bit.
+# 0x8000 stands for negative infinity.
+class AvcVolumeParameter():
+    def __init__(self, unit, subunit_id, fb_id, ch):
+        self.unit = unit
+        self.subunit_id = subunit_id
+        self.fb_id = fb_id
+        self.ch = ch
+
+    def get(self):
+        value = AvcAudio.get_feature_volume_state(self.unit, self.subunit_id,
+                                            'current', self.fb_id, self.ch)
+        if value == 0x8000:
+            return float('-inf')
+        if value & 0x8000:
+            value -= 0x10000
+        return value / 256
+
+    def set(self, db):
+        if db == float('-inf'):
+            value = 0x8000
+        else:
+            value = max(-0x7fff, min(0x7fff, round(db * 256))) & 0xffff
+        AvcAudio.set_feature_volume_state(self.unit, self.subunit_id,
+                                          'current', self.fb_id, self.ch, value)
+
+# Playback gain of Fireworks, in dB. Below -144.0 dB is silence.
+class EfwPlaybackGainParameter():
+    def __init__(self, unit, ch):
+        self.unit = unit
+        self.ch = ch
+
+    def get(self):
+        return self.unit.get_playback_gain(self.ch)
+
+    def set(self, db):
+        self.unit.set_playback_gain(self.ch, max(db, -144.0))
+
+# Fades of many parameters at once. Each job has the parameter, the target
+# in dB, the duration in seconds and the name of curve. The steps are
+# computed in dB before sending, and each step has its deadline on the
+# timeline from the start, thus late steps don't shift the later ones.
+# When a job is behind, the steps already due are skipped except for the
+# last one, so that the value never lags. The interval of steps is bounded
+# by the throughput of the device, measured by reading the start values.
+class RampEngine():
+    curves = {
+        'linear':   lambda t: t,
+        'smooth':   lambda t: (1 - cos(pi * t)) / 2,
+        'fast':     lambda t: 1 - (1 - t) ** 2,
+        'slow':     lambda t: t ** 2,
+    }
+
+    # Throughput is the number of writes per second which the device
+    # sustains. Values below the floor in dB are interpolated from it.
+    def __init__(self, throughput=None, floor=-90.0, max_rate=100):
+        if throughput is not None and throughput <= 0:
+            raise ValueError('Invalid argument for throughput')
+        if max_rate <= 0:
+            raise ValueError('Invalid argument for rate of steps')
+        self.throughput = throughput
+        self.floor = floor
+        self.max_rate = max_rate
+        self._jobs = []
+
+    def add(self, param, target, duration, curve='linear'):
+        if curve not in RampEngine.curves:
+            raise ValueError('Invalid argument for curve')
+        if duration < 0:
+            raise ValueError('Invalid argument for duration')
+        self._jobs.append((param, target, duration, curve))
+
+    # Returns a report of the steps, with lateness in seconds.
+    def run(self):
+        jobs = self._jobs
+        self._jobs = []
+        if len(jobs) == 0:
+            return {'throughput': self.throughput, 'elapsed': 0.0, 'jobs': []}
+
+        begin = monotonic()
+        starts = [param.get() for param, target, duration, curve in jobs]
+        throughput = self.throughput
+        if throughput is None:
+            throughput = len(jobs) / max(monotonic() - begin, 1e-6)
+        interval = max(len(jobs) / throughput, 1 / self.max_rate)
+
+        schedules = []
+        for (param, target, duration, curve), start in zip(jobs, starts):
+            schedules.append(self._schedule(start, target, duration,
+                                            RampEngine.curves[curve],
+                                            interval))
+
+        reports = [{'steps': len(steps), 'sent': 0, 'skipped': 0,
+                    'max-late': 0.0, 'total-late': 0.0}
+                   for steps in schedules]
+        queue = []
+        origin = monotonic()
+        for i, steps in enumerate(schedules):
+            heappush(queue, (steps[0][0], i, 0))
+        while len(queue) > 0:
+            deadline, i, index = heappop(queue)
+            steps = schedules[i]
+            now = monotonic()
+            if origin + deadline > now:
+                sleep(origin + deadline - now)
+                now = monotonic()
+            # Skip to the last step due.
+            while index + 1 < len(steps) and \
+                  origin + steps[index + 1][0] <= now:
+                index += 1
+                reports[i]['skipped'] += 1
+            jobs[i][0].set(steps[index][1])
+            late = max(monotonic() - origin - steps[index][0], 0.0)
+            report = reports[i]
+            report['sent'] += 1
+            report['max-late'] = max(report['max-late'], late)
+            report['total-late'] += late
+            if index + 1 < len(steps):
+                heappush(queue, (steps[index + 1][0], i, index + 1))
+
+        for report in reports:
+            report['mean-late'] = report.pop('total-late') / report['sent']
+        return {
+            'throughput':   throughput,
+            'elapsed':      monotonic() - begin,
+            'jobs':         reports,
+        }
+
+    # A list of (time from the start, value in dB). The last step has the
+    # target as is.
+    def _schedule(self, start, target, duration, curve, interval):
+        count = max(1, int(duration / interval))
+        begin = max(start, self.floor)
+        end = max(target, self.floor)
+        steps = []
+        for k in range(1, count):
+            t = k / count
+            steps.append((duration * t, begin + (end - begin) * curve(t)))
+        steps.append((duration, target))
+        return steps
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from threading import Condition
+from threading import Thread
+from time import monotonic
+
+# A queue of writes in which the latest value wins. A write waiting for its
+# turn is replaced by a newer write for the same key, thus the queue never
+# holds more than one write per parameter and a fader move results in the
+# last value and as few intermediate values as the device takes. The writes
+# are sent by a worker, up to the given number per second if any.
+class CoalescingWriter():
+    def __init__(self, rate=None):
+        if rate is not None and rate <= 0:
+            raise ValueError('Invalid argument for rate of writes')
+        if rate is None:
+            self.interval = 0.0
+        else:
+            self.interval = 1 / rate
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self._pending = OrderedDict()
+        self._busy = False
+        self._errors = []
+        self._closed = False
+        self._cond = Condition()
+        self._worker = Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # The write keeps the place of the superseded one in the queue, so that
+    # a busy parameter doesn't delay the others.
+    def submit(self, key, func, *args):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Writer is already closed')
+            self.submitted += 1
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (func, args)
+            self._cond.notify_all()
+
+    # For setters of which the last argument is the value, e.g.
+    # call(AvcAudio.set_feature_volume_state, unit, 0, 'current', fb_id, ch,
+    # vol) or call(fireworks.set_playback_gain, ch, db). The other arguments
+    # identify the parameter.
+    def call(self, func, *args):
+        if len(args) == 0:
+            raise ValueError('Invalid argument for setter')
+        self.submit((func, ) + args[:-1], func, *args)
+
+    # Wait until all of writes are sent, then raise the first error if any.
+    def flush(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(
+                        lambda: len(self._pending) == 0 and not self._busy,
+                        timeout):
+                raise TimeoutError('Writes are still pending')
+            errors = self._errors
+            self._errors = []
+        if len(errors) > 0:
+            raise errors[0]
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join()
+
+    def as_dict(self):
+        with self._cond:
+            return {
+                'submitted':    self.submitted,
+                'coalesced':    self.coalesced,
+                'sent':         self.sent,
+                'pending':      len(self._pending),
+            }
+
+    def _run(self):
+        last = None
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                            lambda: len(self._pending) > 0 or self._closed)
+                if len(self._pending) == 0:
+                    break
+                if last is not None and self.interval > 0:
+                    # Newer writes can supersede pending ones meanwhile.
+                    deadline = last + self.interval
+                    self._cond.wait_for(
+                            lambda: monotonic() >= deadline or self._closed,
+                            deadline - monotonic())
+                key, (func, args) = self._pending.popitem(last=False)
+                self._busy = True
+            last = monotonic()
+            try:
+                func(*args)
+            except Exception as e:
+                with self._cond:
+                    self._errors.append(e)
+            with self._cond:
+                self._busy = False
+                self.sent += 1
+                self._cond.notify_all()
@@ -0,0 +1,52 @@
+from struct import pack
+from struct import unpack
+from time import monotonic
+
+from ta1394.recorder import TransactionLog
+from ta1394.recorder import TransactionReplayer
+
+from echoaudio.transactions import get_array
+
+# EFW transactions are kept in the same log as FCP. The request frame has
+# category, command and arguments, and the response frame has parameters,
+# in big-endian quadlets.
+def _pack_request(category, command, args):
+    return pack('>{0}I'.format(2 + len(args)), category, command, *args)
+
+def _pack_response(params):
+    return pack('>{0}I'.format(len(params)), *params)
+
+# Wrap Hinawa.SndEfw, then use it instead of the unit.
+class EfwRecorder():
+    def __init__(self, unit, path):
+        self._unit = unit
+        self._fp = TransactionLog.open_writer(path)
+        self._begin = monotonic()
+
+    def transact(self, category, command, args):
+        request = _pack_request(category, command, args)
+        begin = monotonic()
+        try:
+            params = self._unit.transact(category, command, args)
+        except Exception as e:
+            result = TransactionLog.get_result(e)
+            TransactionLog.write(self._fp, 'efw', result, begin - self._begin,
+                                 monotonic() - begin, request, str(e).encode())
+            raise
+        TransactionLog.write(self._fp, 'efw', 'response', begin - self._begin,
+                             monotonic() - begin, request,
+                             _pack_response(params))
+        return params
+
+    def close(self):
+        self._fp.close()
+
+class EfwReplayer(TransactionReplayer):
+    def __init__(self, path, realtime=False):
+        super().__init__(path, 'efw', realtime)
+
+    def transact(self, category, command, args):
+        response = self._replay(_pack_request(category, command, args))
+        params = get_array()
+        params.extend(unpack('>{0}I'.format(len(response) // 4), response))
+        return params
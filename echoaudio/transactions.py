@@ -1,6 +1,5 @@
 from array import array
 from math import log10
-from gi.repository import Hinawa
 
 # This should not be imported.
 def get_array():
@@ -126,7 +125,7 @@ class EftInfo():
     }
 
     def _execute_command(unit, cmd, args):
-        if not isinstance(unit, Hinawa.SndEfw):
+        if not hasattr(unit, 'transact'):
             raise ValueError('Invalid argument for SndEfw')
         return unit.transact(0, cmd, args)
 
@@ -310,7 +309,7 @@ class EftInfo():
 #
 class EftFlash():
     def _execute_command(unit, cmd, args):
-        if not isinstance(unit, Hinawa.SndEfw):
+        if not hasattr(unit, 'transact'):
             raise ValueError('Invalid argument for SndEfw')
         return unit.transact(1, cmd, args)
 
@@ -368,7 +367,7 @@ class EftTransmit():
     supported_serial_data_formats = ('left-adjusted', 'i2s')
 
     def _execute_command(unit, cmd, args):
-        if not isinstance(unit, Hinawa.SndEfw):
+        if not hasattr(unit, 'transact'):
             raise ValueError('Invalid argument for SndEfw')
         return unit.transact(2, cmd, args)
 
@@ -435,7 +434,7 @@ class EftHwctl():
 
     @staticmethod
     def execute_command(unit, cmd, args):
-        if not isinstance(unit, Hinawa.SndEfw):
+        if not hasattr(unit, 'transact'):
             raise ValueError('Invalid argument for SndEfw')
         return unit.transact(3, cmd, args)
 
@@ -519,7 +518,7 @@ class EftPhysOutput():
 
     @staticmethod
     def execute_command(unit, cmd, args):
-        if not isinstance(unit, Hinawa.SndEfw):
+        if not hasattr(unit, 'transact'):
             raise ValueError('Invalid argument for SndEfw')
         return unit.transact(4, cmd, args)
 
@@ -570,7 +569,7 @@ class EftPhysInput():
     operations = ('nominal')
 
     def _execute_command(unit, cmd, args):
-        if not isinstance(unit, Hinawa.SndEfw):
+        if not hasattr(unit, 'transact'):
             raise ValueError('Invalid argument for SndEfw')
         return unit.transact(5, cmd, args)
 
@@ -607,7 +606,7 @@ class EftPlayback():
 
     @staticmethod
     def execute_command(unit, cmd, args):
-        if not isinstance(unit, Hinawa.SndEfw):
+        if not hasattr(unit, 'transact'):
             raise ValueError('Invalid argument for SndEfw')
         return unit.transact(6, cmd, args)
 
@@ -629,7 +628,7 @@ class EftPlayback():
         args = get_array()
         args.append(channel)
         args.append(value)
-        EftPhysInput.execute_command(unit, cmd, args)
+        EftPlayback.execute_command(unit, cmd, args)
 
     @staticmethod
     def get_param(unit, operation, channel):
@@ -645,7 +644,7 @@ class EftPlayback():
         args.append(channel)
         params = EftPlayback.execute_command(unit, cmd, args)
         if operation is 'gain':
-            params[1] = calculate_vol_to_db(params[1])
+            return calculate_vol_to_db(params[1])
         return params[1]
 
 class EftCapture():
@@ -653,7 +652,7 @@ class EftCapture():
 
     @staticmethod
     def execute_command(unit, cmd, args):
-        if not isinstance(unit, Hinawa.SndEfw):
+        if not hasattr(unit, 'transact'):
             raise ValueError('Invalid argument for SndEfw')
         return unit.transact(7, cmd, args)
 
@@ -665,7 +664,7 @@ class EftMonitor():
 
     @staticmethod
     def execute_command(unit, cmd, args):
-        if not isinstance(unit, Hinawa.SndEfw):
+        if not hasattr(unit, 'transact'):
             raise ValueError('Invalid argument for SndEfw')
         return unit.transact(8, cmd, args)
 
@@ -722,7 +721,7 @@ class EftIoconf():
     digital_input_modes = ('spdif-coax', 'aesebu-xlr', 'spdif-opt', 'adat-opt')
 
     def _execute_command(unit, cmd, args):
-        if not isinstance(unit, Hinawa.SndEfw):
+        if not hasattr(unit, 'transact'):
             raise ValueError('Invalid argument for SndEfw')
         return unit.transact(9, cmd, args)
 
@@ -5,7 +5,7 @@ import sys
 from gi.repository import Hinawa
 from ta1394.general import AvcGeneral
 from ta1394.general import AvcConnection
-from ta1394.streamformat import AvcStreamFormat
+from ta1394.streamformat import AvcStreamFormatInfo
 
 argv = sys.argv
 argc = len(argv)
@@ -100,4 +100,4 @@ for rate in AvcGeneral.sampling_rates:
     if AvcGeneral.ask_plug_signal_format(unit, 'output', 0, rate):
         print(rate)
 """
-print(AvcStreamFormat.get_format(unit, 'input', 0))
+print(AvcStreamFormatInfo.get_format(unit, 'input', 0))
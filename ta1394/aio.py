@@ -0,0 +1,108 @@
+import asyncio
+from inspect import isgeneratorfunction
+from inspect import signature
+
+from ta1394.general import AvcGeneral
+from ta1394.general import AvcConnection
+from ta1394.audio import AvcAudio
+from ta1394.ccm import AvcCcm
+from ta1394.streamformat import AvcStreamFormatInfo
+from ta1394.pipeline import AvcPipeline
+
+# A unit for asyncio. FCP transactions are blocking, thus they run in the
+# worker of AvcPipeline for the unit and the event loop just awaits them.
+# The worker is shared with the other users of the unit, and serves any
+# number of coroutines.
+class AvcAsyncUnit():
+    def __init__(self, unit, timeout=None):
+        self.unit = unit
+        self.timeout = timeout
+
+    # The same instance is used for the same unit.
+    @staticmethod
+    def get(unit):
+        if isinstance(unit, AvcAsyncUnit):
+            return unit
+        async_unit = getattr(unit, '_avc_async_unit', None)
+        if async_unit is None:
+            async_unit = AvcAsyncUnit(unit)
+            try:
+                unit._avc_async_unit = async_unit
+            except AttributeError:
+                pass
+        return async_unit
+
+    # When the awaiting task is cancelled or timed out before the command is
+    # sent, the command is dropped. When it is already sent, the response is
+    # discarded.
+    async def call(self, func, *args, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        pipeline = AvcPipeline.get(self.unit)
+        future = asyncio.wrap_future(pipeline.call(func, *args))
+        return await asyncio.wait_for(future, timeout)
+
+    # The worker exits by itself when idle, since it is shared.
+    def close(self):
+        pass
+
+def _mirror(cls):
+    attrs = {}
+    for name, attr in vars(cls).items():
+        if name.startswith('_') or not isinstance(attr, staticmethod):
+            continue
+        func = attr.__func__
+        params = list(signature(func).parameters)
+        # Builders and parsers have no unit and need no transaction.
+        if len(params) == 0 or params[0] != 'unit':
+            continue
+        if isgeneratorfunction(func):
+            attrs[name] = staticmethod(_async_generator(func))
+        else:
+            attrs[name] = staticmethod(_coroutine(func))
+    return type('Async' + cls.__name__, (cls,), attrs)
+
+def _coroutine(func):
+    async def command(unit, *args, timeout=None):
+        return await AvcAsyncUnit.get(unit).call(func, *args, timeout=timeout)
+    command.__name__ = func.__name__
+    command.__qualname__ = func.__qualname__
+    return command
+
+# Generators send transactions when resumed, thus each step runs in the
+# worker as well, e.g. async for fmt in
+# AsyncAvcStreamFormatInfo.iterate_formats(unit, 'input', 0). The generator
+# is closed in the worker after the step in flight, if any.
+def _async_generator(func):
+    async def iterate(unit, *args, timeout=None, **kwargs):
+        async_unit = AvcAsyncUnit.get(unit)
+        gen = func(async_unit.unit, *args, **kwargs)
+        try:
+            while True:
+                item = await async_unit.call(_step, gen, timeout=timeout)
+                if item is _end:
+                    break
+                yield item
+        finally:
+            try:
+                AvcPipeline.get(async_unit.unit).call(_close, gen)
+            except RuntimeError:
+                pass
+    iterate.__name__ = func.__name__
+    iterate.__qualname__ = func.__qualname__
+    return iterate
+
+# StopIteration can't be set to futures, thus the end is told by sentinel.
+_end = object()
+
+def _step(unit, gen):
+    return next(gen, _end)
+
+def _close(unit, gen):
+    gen.close()
+
+AsyncAvcGeneral = _mirror(AvcGeneral)
+AsyncAvcConnection = _mirror(AvcConnection)
+AsyncAvcAudio = _mirror(AvcAudio)
+AsyncAvcCcm = _mirror(AvcCcm)
+AsyncAvcStreamFormatInfo = _mirror(AvcStreamFormatInfo)
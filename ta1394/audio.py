@@ -1,4 +1,11 @@
+from array import array
+from threading import Lock
+from time import monotonic
+
 from ta1394.general import AvcGeneral
+from ta1394.frame import AvcFrame
+from ta1394.pipeline import AvcPipeline
+from ta1394.transport import AvcTransport
 
 class AvcAudio():
     attributes = ('resolution', 'minimum', 'maximum', 'default', 'duration',
@@ -15,54 +22,74 @@ class AvcAudio():
         'delta':        0x19,
     }
 
+    _selector_attributes = ('current', 'minimum', 'maximum', 'default')
+    _mixer_attributes = ('current', 'minimum', 'maximum', 'resolution',
+                         'default')
+
+    # Selector function block, selector length is 2, selector control
+    _selector_frame = AvcFrame('ctype', 'subunit', 0xb8, 0x80, 'fb_id', 'attr',
+                               0x02, 'value', 0x01)
+    # Feature function block, selector length is 2, control data length is 1
+    _feature_byte_frame = AvcFrame('ctype', 'subunit', 0xb8, 0x81, 'fb_id',
+                                   'attr', 0x02, 'ch', 'control', 0x01,
+                                   'value')
+    # Feature function block, selector length is 2, control data length is 2
+    _feature_word_frame = AvcFrame('ctype', 'subunit', 0xb8, 0x81, 'fb_id',
+                                   'attr', 0x02, 'ch', 'control', 0x02,
+                                   ('value', 'H'))
+    # Processing function block, selector length is 4, mixer control, control
+    # data length is 2
+    _mixer_frame = AvcFrame('ctype', 'subunit', 0xb8, 0x82, 'fb_id', 'attr',
+                            0x04, 'in_fb', 'in_ch', 'out_ch', 0x03, 0x02,
+                            ('value', 'H'))
+    # Processing function block, selector length is 4, mixer control. Control
+    # data follows the length of it.
+    _mixer_all_frame = AvcFrame('ctype', 'subunit', 0xb8, 0x82, 'fb_id', 'attr',
+                                0x04, 'in_fb', 0xff, 0xff, 0x03, 'length')
+
+    _mute_control = 0x01
+    _volume_control = 0x02
+    _lr_control = 0x03
+
     @staticmethod
     def set_selector_state(unit, subunit_id, attr, fb_id, value):
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if ('current', 'minimum', 'maximum', 'default').count(attr) == 0:
+        if attr not in AvcAudio._selector_attributes:
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
         if value > 255:
             raise ValueError('Invalid argument for selector value')
-        args = bytearray()
-        args.append(0x00)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x80)   # Selector function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attribute])
-        args.append(0x02)   # Selector length is 2
-        args.append(value)
-        args.append(0x01)   # Selector control
+        args = AvcAudio._selector_frame.build(0x00, 0x08 | (subunit_id & 0x07),
+                            fb_id, AvcAudio.attribute_values[attr], value)
         AvcGeneral.command_control(unit, args)
+        AvcAudioCache.store(unit, (subunit_id, 0x80, fb_id, 0, 0, attr), value)
 
     @staticmethod
     def get_selector_state(unit, subunit_id, attr, fb_id):
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if ('current', 'minimum', 'maximum', 'default').count(attr) == 0:
+        if attr not in AvcAudio._selector_attributes:
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
-        args = bytearray()
-        args.append(0x01)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x80)   # Selector function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x02)   # Selector length is 2
-        args.append(0xff)
-        args.append(0x01)   # Selector control
+        key = (subunit_id, 0x80, fb_id, 0, 0, attr)
+        value = AvcAudioCache.lookup(unit, key)
+        if value is not None:
+            return value
+        args = AvcAudio._selector_frame.build(0x01, 0x08 | (subunit_id & 0x07),
+                            fb_id, AvcAudio.attribute_values[attr], 0xff)
         params = AvcGeneral.command_status(unit, args)
-        return params[7]
+        value = params[7]
+        AvcAudioCache.store(unit, key, value)
+        return value
 
     @staticmethod
     def set_feature_mute_state(unit, subunit_id, attr, fb_id, ch, mute):
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if attr is not 'current':
+        if attr != 'current':
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
@@ -72,159 +99,130 @@ class AvcAudio():
             mute = 0x70
         else:
             mute = 0x80
-        args = bytearray()
-        args.append(0x00)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x81)   # Feature function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x02)   # Selector length is 2
-        args.append(ch)
-        args.append(0x01)   # Mute control
-        args.append(0x01)   # Control data length is 1
-        args.append(mute)
+        args = AvcAudio._feature_byte_frame.build(0x00,
+                            0x08 | (subunit_id & 0x07), fb_id,
+                            AvcAudio.attribute_values[attr], ch,
+                            AvcAudio._mute_control, mute)
         AvcGeneral.command_control(unit, args)
+        key = (subunit_id, 0x81, fb_id, ch, AvcAudio._mute_control, attr)
+        AvcAudioCache.store(unit, key, mute == 0x70)
 
     @staticmethod
     def get_feature_mute_state(unit, subunit_id, attr, fb_id, ch):
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if attr is not 'current':
+        if attr != 'current':
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
         if ch > 255:
             raise ValueError('Invalid argument for channel number')
-        args = bytearray()
-        args.append(0x01)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x81)   # Feature function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x02)   # Selector length is 2
-        args.append(ch)
-        args.append(0x01)   # Mute control
-        args.append(0x01)   # Control data length is 1
-        args.append(0xff)   # Status
+        key = (subunit_id, 0x81, fb_id, ch, AvcAudio._mute_control, attr)
+        value = AvcAudioCache.lookup(unit, key)
+        if value is not None:
+            return value
+        args = AvcAudio._feature_byte_frame.build(0x01,
+                            0x08 | (subunit_id & 0x07), fb_id,
+                            AvcAudio.attribute_values[attr], ch,
+                            AvcAudio._mute_control, 0xff)
         params = AvcGeneral.command_status(unit, args)
         if params[10] == 0x70:
-            return True
+            value = True
         elif params[10] == 0x60:
-            return False
+            value = False
         else:
             raise OSError('Unexpected value in response')
+        AvcAudioCache.store(unit, key, value)
+        return value
 
     @staticmethod
     def set_feature_volume_state(unit, subunit_id, attr, fb_id, ch, vol):
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if AvcAudio.attributes.count(attr) == 0:
+        if attr not in AvcAudio.attribute_values:
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
         if ch > 255:
             raise ValueError('Invalid argument for channel number')
-        args = bytearray()
-        args.append(0x00)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x81)   # Feature function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x02)   # Selector length is 2
-        args.append(ch)
-        args.append(0x02)   # Volume control
-        args.append(0x02)   # Control data length is 2
-        args.append(vol >> 8)   # Higher part of volume
-        args.append(vol & 0xff) # Lower part of volume
+        args = AvcAudio._feature_word_frame.build(0x00,
+                            0x08 | (subunit_id & 0x07), fb_id,
+                            AvcAudio.attribute_values[attr], ch,
+                            AvcAudio._volume_control, vol)
         AvcGeneral.command_control(unit, args)
+        key = (subunit_id, 0x81, fb_id, ch, AvcAudio._volume_control, attr)
+        AvcAudioCache.store(unit, key, vol)
 
     @staticmethod
     def get_feature_volume_state(unit, subunit_id, attr, fb_id, ch):
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if AvcAudio.attributes.count(attr) == 0:
+        if attr not in AvcAudio.attribute_values:
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
         if ch > 255:
             raise ValueError('Invalid argument for channel number')
-        args = bytearray()
-        args.append(0x01)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x81)   # Feature function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x02)   # Selector length is 2
-        args.append(ch)
-        args.append(0x02)   # Volume control
-        args.append(0x02)   # Control data length is 2
-        args.append(0xff)   # Higher part of volume
-        args.append(0xff)   # Lower part of volume
+        key = (subunit_id, 0x81, fb_id, ch, AvcAudio._volume_control, attr)
+        value = AvcAudioCache.lookup(unit, key)
+        if value is not None:
+            return value
+        args = AvcAudio._feature_word_frame.build(0x01,
+                            0x08 | (subunit_id & 0x07), fb_id,
+                            AvcAudio.attribute_values[attr], ch,
+                            AvcAudio._volume_control, 0xffff)
         params = AvcGeneral.command_status(unit, args)
-        return (params[10] << 8) | params[11]
+        value = (params[10] << 8) | params[11]
+        AvcAudioCache.store(unit, key, value)
+        return value
 
     @staticmethod
     def set_feature_lr_state(unit, subunit_id, attr, fb_id, ch, balance):
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if AvcAudio.attributes.count(attr) == 0:
+        if attr not in AvcAudio.attribute_values:
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
         if ch > 255:
             raise ValueError('Invalid argument for channel number')
-        args = bytearray()
-        args.append(0x00)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x81)   # Feature function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x02)   # Selector length is 2
-        args.append(ch)
-        args.append(0x03)   # LR control
-        args.append(0x02)   # Control data length is 2
-        args.append(balance >> 8)   # Higher part of balance
-        args.append(balance & 0xff) # Lower part of balance
+        args = AvcAudio._feature_word_frame.build(0x00,
+                            0x08 | (subunit_id & 0x07), fb_id,
+                            AvcAudio.attribute_values[attr], ch,
+                            AvcAudio._lr_control, balance)
         AvcGeneral.command_control(unit, args)
+        key = (subunit_id, 0x81, fb_id, ch, AvcAudio._lr_control, attr)
+        AvcAudioCache.store(unit, key, balance)
 
     @staticmethod
     def get_feature_lr_state(unit, subunit_id, attr, fb_id, ch):
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if AvcAudio.attributes.count(attr) == 0:
+        if attr not in AvcAudio.attribute_values:
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
         if ch > 255:
             raise ValueError('Invalid argument for channel number')
-        args = bytearray()
-        args.append(0x01)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x81)   # Feature function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x02)   # Selector length is 2
-        args.append(ch)
-        args.append(0x03)   # LR control
-        args.append(0x02)   # Control data length is 2
-        args.append(0xff)   # Higher part of balance
-        args.append(0xff)   # Lower part of balance
+        key = (subunit_id, 0x81, fb_id, ch, AvcAudio._lr_control, attr)
+        value = AvcAudioCache.lookup(unit, key)
+        if value is not None:
+            return value
+        args = AvcAudio._feature_word_frame.build(0x01,
+                            0x08 | (subunit_id & 0x07), fb_id,
+                            AvcAudio.attribute_values[attr], ch,
+                            AvcAudio._lr_control, 0xffff)
         params = AvcGeneral.command_status(unit, args)
-        return (params[10] << 8) | params[11]
+        value = (params[10] << 8) | params[11]
+        AvcAudioCache.store(unit, key, value)
+        return value
 
     @staticmethod
     def set_processing_mixer_state(unit, subunit_id, attr, fb_id, in_fb,
                                    in_ch, out_ch, setting):
-        attrs = ('current', 'minimum', 'maximum', 'resolution', 'default')
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if attrs.count(attr) == 0:
+        if attr not in AvcAudio._mixer_attributes:
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
@@ -234,30 +232,17 @@ class AvcAudio():
             raise ValueError('Invalid argument for input channel number')
         if out_ch > 255:
             raise ValueError('Invalid argument for output channel number')
-        args = bytearray()
-        args.append(0x00)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x82)   # Processing function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x04)   # Selector length is 4
-        args.append(in_fb)
-        args.append(in_ch)
-        args.append(out_ch)
-        args.append(0x03)   # Mixer control
-        args.append(0x02)   # Control data is 2
-        args.append(setting >> 8)   # Higher part of setting
-        args.append(setting & 0xff) # Lower part of setting
+        args = AvcAudio._mixer_frame.build(0x00, 0x08 | (subunit_id & 0x07),
+                            fb_id, AvcAudio.attribute_values[attr], in_fb,
+                            in_ch, out_ch, setting)
         AvcGeneral.command_control(unit, args)
 
     @staticmethod
     def get_processing_mixer_state(unit, subunit_id, attr, fb_id, in_fb,
                                    in_ch, out_ch):
-        attrs = ('current', 'minimum', 'maximum', 'resolution', 'default')
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if attrs.count(attr) == 0:
+        if attr not in AvcAudio._mixer_attributes:
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
@@ -267,81 +252,225 @@ class AvcAudio():
             raise ValueError('Invalid argument for input channel number')
         if out_ch > 255:
             raise ValueError('Invalid argument for output channel number')
-        args = bytearray()
-        args.append(0x01)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x82)   # Processing function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x04)   # Selector length is 4
-        args.append(in_fb)
-        args.append(in_ch)
-        args.append(out_ch)
-        args.append(0x03)   # Mixer control
-        args.append(0x02)   # Control data is 2
-        args.append(0xff)   # Higher part of setting
-        args.append(0xff)   # Lower part of setting
+        args = AvcAudio._mixer_frame.build(0x01, 0x08 | (subunit_id & 0x07),
+                            fb_id, AvcAudio.attribute_values[attr], in_fb,
+                            in_ch, out_ch, 0xffff)
         params = AvcGeneral.command_status(unit, args)
         return (params[12] << 8) | params[13]
 
     @staticmethod
     def set_processing_mixer_state_all(unit, subunit_id, attr, fb_id, in_fb,
                                        states):
-        attrs = ('current', 'minimum', 'maximum', 'resolution', 'default')
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if attrs.count(attr) == 0:
+        if attr not in AvcAudio._mixer_attributes:
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
         if in_fb > 255:
             raise ValueError('Invalid argument for input function block ID')
-        data_count = len(states) // 2
-        args = bytearray()
-        args.append(0x00)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x82)   # Processing function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x04)   # Selector length is 4
-        args.append(in_fb)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0x03)   		# Mixer control
-        args.append(data_count)	# The length of control data
-        for i in range(data_count):
-            args.append((states[i * 2] << 8) | states[i * 2 + 1])
+        # The length of control data is in byte.
+        if len(states) * 2 > 255:
+            raise ValueError('Invalid argument for the number of states')
+        args = bytearray(AvcAudio._mixer_all_frame.build(0x00,
+                            0x08 | (subunit_id & 0x07), fb_id,
+                            AvcAudio.attribute_values[attr], in_fb,
+                            len(states) * 2))
+        for state in states:
+            args.append((state >> 8) & 0xff)
+            args.append(state & 0xff)
         AvcGeneral.command_control(unit, args)
 
     @staticmethod
     def get_processing_mixer_state_all(unit, subunit_id, attr, fb_id, in_fb):
-        attrs = ('current', 'minimum', 'maximum', 'resolution', 'default')
         if subunit_id > 0x07:
             raise ValueError('Invalid argument for subunit ID')
-        if attrs.count(attr) == 0:
+        if attr not in AvcAudio._mixer_attributes:
             raise ValueError('Invalid argument for attribute')
         if fb_id > 255:
             raise ValueError('Invalid argument for function block ID')
         if in_fb > 255:
             raise ValueError('Invalid argument for input function block ID')
-        args = bytearray()
-        args.append(0x01)
-        args.append(0x08 | (subunit_id & 0x07))
-        args.append(0xb8)
-        args.append(0x82)   # Processing function block
-        args.append(fb_id)
-        args.append(AvcAudio.attribute_values[attr])
-        args.append(0x04)   # Selector length is 4
-        args.append(in_fb)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0x03)   # Mixer control
-        args.append(0xff)   # The length of control data in response
+        # The length of control data is in response.
+        args = AvcAudio._mixer_all_frame.build(0x01, 0x08 | (subunit_id & 0x07),
+                            fb_id, AvcAudio.attribute_values[attr], in_fb, 0xff)
         params = AvcGeneral.command_status(unit, args)
         count = params[11] // 2
         status = []
         for i in range(count):
             status.append((params[12 + i * 2] << 8) | params[13 + i * 2])
         return status
+
+# Settings of selector and feature function blocks, kept per unit and
+# updated by each accepted control. Getters return the kept value within
+# max_age seconds since it was read or written. The key is (subunit ID,
+# function block type, function block ID, channel, control, attribute).
+# Nothing is cached until enabled for the unit. Getters and setters run in
+# any thread, e.g. the worker of AvcPipeline, thus the entries are guarded
+# by lock.
+class AvcAudioCache():
+    def __init__(self, max_age=1.0):
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def enable(unit, max_age=1.0):
+        transport = AvcTransport.bind(unit)
+        if transport.audio_cache is None:
+            transport.audio_cache = AvcAudioCache(max_age)
+        return transport.audio_cache
+
+    @staticmethod
+    def disable(unit):
+        transport = AvcTransport.bind(unit)
+        cache = transport.audio_cache
+        transport.audio_cache = None
+        return cache
+
+    @staticmethod
+    def get(unit):
+        return AvcTransport.bind(unit).audio_cache
+
+    @staticmethod
+    def lookup(unit, key):
+        cache = AvcTransport.bind(unit).audio_cache
+        if cache is None:
+            return None
+        with cache._lock:
+            entry = cache._entries.get(key)
+            if entry is None or monotonic() - entry[1] > cache.max_age:
+                cache.misses += 1
+                return None
+            cache.hits += 1
+            return entry[0]
+
+    # Relative changes make the other attributes of the control unknown.
+    @staticmethod
+    def store(unit, key, value):
+        cache = AvcTransport.bind(unit).audio_cache
+        if cache is None:
+            return
+        with cache._lock:
+            if key[5] in ('move', 'delta'):
+                for attr in AvcAudio.attributes:
+                    cache._entries.pop(key[:5] + (attr, ), None)
+            else:
+                cache._entries[key] = (value, monotonic())
+
+    # Drop the entries which match all of given fields.
+    def invalidate(self, subunit_id=None, fb_type=None, fb_id=None, ch=None):
+        fields = (subunit_id, fb_type, fb_id, ch)
+        with self._lock:
+            if fields == (None, None, None, None):
+                self._entries.clear()
+                return
+            for key in list(self._entries):
+                if all(field is None or field == key[i]
+                       for i, field in enumerate(fields)):
+                    del self._entries[key]
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'entries':  len(self._entries),
+                'hits':     self.hits,
+                'misses':   self.misses,
+            }
+
+# The current settings of a mixer in a processing function block. Each row
+# is for an input function block and has the settings of all crosspoints
+# from it, in the order of input channel then output channel, as *_all
+# commands transfer them. Channels start at 1 as crosspoint commands take.
+# Rows read from the unit are kept as the state, and writes send only the
+# difference from it.
+class AvcMixerMatrix():
+    def __init__(self, unit, subunit_id, fb_id, in_fbs, outputs):
+        if outputs < 1:
+            raise ValueError('Invalid argument for the number of outputs')
+        self.unit = unit
+        self.subunit_id = subunit_id
+        self.fb_id = fb_id
+        self.in_fbs = tuple(in_fbs)
+        self.outputs = outputs
+        self._rows = {}
+
+    # Read all of rows in pipeline.
+    def load(self):
+        futures = []
+        pipeline = AvcPipeline.get(self.unit)
+        for in_fb in self.in_fbs:
+            future = pipeline.call(AvcAudio.get_processing_mixer_state_all,
+                            self.subunit_id, 'current', self.fb_id, in_fb)
+            futures.append((in_fb, future))
+        for in_fb, future in futures:
+            self._rows[in_fb] = array('H', future.result())
+
+    def invalidate(self, in_fb=None):
+        if in_fb is None:
+            self._rows.clear()
+        else:
+            self._rows.pop(in_fb, None)
+
+    def get_row(self, in_fb):
+        return list(self._get_row(in_fb))
+
+    def get(self, in_fb, in_ch, out_ch):
+        row = self._get_row(in_fb)
+        return row[self._get_index(row, in_ch, out_ch)]
+
+    def set(self, in_fb, in_ch, out_ch, value):
+        return self.apply({in_fb: {(in_ch, out_ch): value}})
+
+    # The matrix maps input function block to the whole row, or to a
+    # dictionary of (input channel, output channel) and the setting. A row
+    # with one changed crosspoint is sent by the command for the crosspoint,
+    # and a row with more by the command for the row. Returns the number of
+    # commands and crosspoints sent.
+    def apply(self, matrix):
+        commands = 0
+        cells = 0
+        for in_fb, values in matrix.items():
+            row = self._get_row(in_fb)
+            if isinstance(values, dict):
+                desired = array('H', row)
+                for (in_ch, out_ch), value in values.items():
+                    desired[self._get_index(row, in_ch, out_ch)] = value
+            else:
+                desired = array('H', values)
+                if len(desired) != len(row):
+                    raise ValueError('Invalid argument for the row of mixer')
+            changes = [i for i in range(len(row)) if row[i] != desired[i]]
+            if len(changes) == 0:
+                continue
+            elif len(changes) == 1:
+                in_ch, out_ch = divmod(changes[0], self.outputs)
+                AvcAudio.set_processing_mixer_state(self.unit, self.subunit_id,
+                                'current', self.fb_id, in_fb, in_ch + 1,
+                                out_ch + 1, desired[changes[0]])
+            else:
+                AvcAudio.set_processing_mixer_state_all(self.unit,
+                                self.subunit_id, 'current', self.fb_id, in_fb,
+                                desired)
+            self._rows[in_fb] = desired
+            commands += 1
+            cells += len(changes)
+        return {'commands': commands, 'cells': cells}
+
+    def _get_row(self, in_fb):
+        if in_fb not in self._rows:
+            if in_fb not in self.in_fbs:
+                raise ValueError('Invalid argument for input function block')
+            self._rows[in_fb] = array('H',
+                    AvcAudio.get_processing_mixer_state_all(self.unit,
+                            self.subunit_id, 'current', self.fb_id, in_fb))
+        return self._rows[in_fb]
+
+    def _get_index(self, row, in_ch, out_ch):
+        if in_ch < 1 or in_ch > len(row) // self.outputs:
+            raise ValueError('Invalid argument for input channel number')
+        if out_ch < 1 or out_ch > self.outputs:
+            raise ValueError('Invalid argument for output channel number')
+        return (in_ch - 1) * self.outputs + out_ch - 1
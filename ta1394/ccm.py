@@ -1,90 +1,350 @@
+from types import MappingProxyType
+
 from ta1394.general import AvcGeneral
+from ta1394.general import AvcConnection
+from ta1394.frame import AvcFrame
+from ta1394.transport import AvcTransport
+from ta1394.pipeline import AvcPipeline
+
+# An immutable signal address. The decode table has a row of 256 addresses
+# for each first byte, built at first use, thus decoding an address returns
+# the interned instance without allocation. For compatibility, it is also
+# available as the dictionary of former parse_signal_addr(), e.g.
+# addr['data']['plug'].
+class AvcSignalAddr():
+    __slots__ = ('addr', 'mode', 'type', 'id', 'plug', '_data')
+
+    _rows = [None] * 256
+
+    _keys = ('mode', 'data')
+
+    def __init__(self, addr, mode, type, id, plug):
+        object.__setattr__(self, 'addr', addr)
+        object.__setattr__(self, 'mode', mode)
+        object.__setattr__(self, 'type', type)
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'plug', plug)
+        if mode == 'unit':
+            data = {'type': type, 'plug': plug}
+        else:
+            data = {'type': type, 'id': id, 'plug': plug}
+        object.__setattr__(self, '_data', MappingProxyType(data))
+
+    @staticmethod
+    def decode(addr):
+        row = AvcSignalAddr._rows[addr[0]]
+        if row is None:
+            row = AvcSignalAddr._build_row(addr[0])
+        if len(row) == 0:
+            raise OSError('Unexpected subunit type in signal address')
+        return row[addr[1]]
+
+    @staticmethod
+    def _build_row(first):
+        row = []
+        if first == 0xff:
+            for second in range(256):
+                if second & 0x80:
+                    type, plug = 'external', second - 0x80
+                else:
+                    type, plug = 'isoc', second
+                row.append(AvcSignalAddr(bytes((first, second)), 'unit',
+                                         type, None, plug))
+        elif first >> 3 < len(AvcGeneral.subunit_types):
+            type = AvcGeneral.subunit_types[first >> 3]
+            for second in range(256):
+                row.append(AvcSignalAddr(bytes((first, second)), 'subunit',
+                                         type, first & 0x07, second))
+        row = tuple(row)
+        AvcSignalAddr._rows[first] = row
+        return row
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Signal address is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Signal address is immutable')
+
+    def __hash__(self):
+        return hash(self.addr)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, AvcSignalAddr):
+            return NotImplemented
+        return self.addr == other.addr
+
+    def __repr__(self):
+        return 'AvcSignalAddr({0!r})'.format(self.addr)
+
+    def __getitem__(self, key):
+        if key == 'mode':
+            return self.mode
+        elif key == 'data':
+            return self._data
+        raise KeyError(key)
+
+    def keys(self):
+        return AvcSignalAddr._keys
+
+    def as_dict(self):
+        return {'mode': self.mode, 'data': dict(self._data)}
 
 class AvcCcm():
     plug_mode = ('unit', 'subunit')
     plug_unit_type = ('isoc', 'external')
 
+    _signal_source_frame = AvcFrame('ctype', 0xff, 0x1a, 'status', 'src_0',
+                                    'src_1', 'dst_0', 'dst_1')
+
+    _unit_addrs = {}
+    _subunit_addrs = {}
+
+    # Addresses are interned bytes, thus the same address is the same object.
     @staticmethod
     def get_unit_signal_addr(type, plug):
-        if AvcCcm.plug_unit_type.count(type) == 0:
-            raise ValueError('Invalid argument for plug unit type')
-        if plug >= 30:
-            raise ValueError('Invalid argument for plug number')
-        addr = bytearray()
-        addr.append(0xff)
-        if type == 'isoc':
-            addr.append(plug)
-        else:
-            addr.append(0x80 + plug)
+        key = (type, plug)
+        addr = AvcCcm._unit_addrs.get(key)
+        if addr is None:
+            if type not in AvcCcm.plug_unit_type:
+                raise ValueError('Invalid argument for plug unit type')
+            if plug >= 30:
+                raise ValueError('Invalid argument for plug number')
+            if type == 'isoc':
+                addr = bytes((0xff, plug))
+            else:
+                addr = bytes((0xff, 0x80 + plug))
+            addr = AvcSignalAddr.decode(addr).addr
+            AvcCcm._unit_addrs[key] = addr
         return addr
 
     @staticmethod
     def get_subunit_signal_addr(type, id, plug):
-        if AvcGeneral.subunit_types.count(type) == 0:
-            raise ValueError('Invalid argument for subunit type')
-        if plug >= 30:
-            raise ValueError('Invalid argument for plug number')
-        addr = bytearray()
-        addr.append((AvcGeneral.subunit_types.index(type) << 3) | id)
-        addr.append(plug)
+        key = (type, id, plug)
+        addr = AvcCcm._subunit_addrs.get(key)
+        if addr is None:
+            if type not in AvcGeneral._subunit_type_ids:
+                raise ValueError('Invalid argument for subunit type')
+            if plug >= 30:
+                raise ValueError('Invalid argument for plug number')
+            addr = bytes(((AvcGeneral._subunit_type_ids[type] << 3) | id,
+                          plug))
+            addr = AvcSignalAddr.decode(addr).addr
+            AvcCcm._subunit_addrs[key] = addr
         return addr
 
     @staticmethod
     def parse_signal_addr(addr):
-        info = {}
-        data = {}
-        if addr[0] == 0xff:
-            info['mode'] = 'unit'
-            if addr[1] & 0x80:
-                data['type'] = 'external'
-                data['plug'] = addr[1] - 0x80
-            else:
-                data['type'] = 'isoc'
-                data['plug'] = addr[1]
-        else:
-            info['mode'] = 'subunit'
-            data['type'] = AvcGeneral.subunit_types[addr[0] >> 3]
-            data['id'] = addr[0] & 0x07
-            data['plug'] = addr[1]
-        info['data'] = data
-        return info
+        return AvcSignalAddr.decode(addr)
 
     @staticmethod
     def set_signal_souarce(unit, src, dst):
-        args = bytearray()
-        args.append(0x01)
-        args.append(0xff)
-        args.append(0x1a)
-        args.append(0x0f)
-        args.append(src[0])
-        args.append(src[1])
-        args.append(dst[0])
-        args.append(dst[1])
-        return AvcGeneral.command_control(unit, args)
+        args = AvcCcm._signal_source_frame.build(0x00, 0x0f, src[0], src[1],
+                                                 dst[0], dst[1])
+        try:
+            return AvcGeneral.command_control(unit, args)
+        finally:
+            graph = AvcTransport.bind(unit).ccm_graph
+            if graph is not None:
+                graph.invalidate(dst)
 
     @staticmethod
     def get_signal_source(unit, dst):
-        args = bytearray()
-        args.append(0x01)
-        args.append(0xff)
-        args.append(0x1a)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xfe)
-        args.append(dst[0])
-        args.append(dst[1])
+        args = AvcCcm._signal_source_frame.build(0x01, 0xff, 0xff, 0xfe,
+                                                 dst[0], dst[1])
         params = AvcGeneral.command_status(unit, args)
-        return AvcCcm.parse_signal_addr(params[6:])
+        return AvcCcm.parse_signal_addr(params[4:6])
 
     @staticmethod
     def ask_signal_source(unit, src, dst):
-        args = bytearray()
-        args.append(0x02)
-        args.append(0xff)
-        args.append(0x1a)
-        args.append(0xff)
-        args.append(src[0])
-        args.append(src[1])
-        args.append(dst[0])
-        args.append(dst[1])
+        args = AvcCcm._signal_source_frame.build(0x02, 0xff, src[0], src[1],
+                                                 dst[0], dst[1])
         AvcGeneral.command_inquire(unit, args)
+
+    # Inquire the sources at once in pipeline. Returns a list of boolean in
+    # the order of the sources, True when the source is connectable.
+    @staticmethod
+    def ask_signal_sources(unit, srcs, dst):
+        futures = []
+        pipeline = AvcPipeline.get(unit)
+        for src in srcs:
+            args = AvcCcm._signal_source_frame.build(0x02, 0xff, src[0],
+                                                src[1], dst[0], dst[1])
+            futures.append(pipeline.transact(args))
+        return [future.result()[0] == 0x0c for future in futures]
+
+# A graph of signal routing. Nodes are signal addresses in bytes, and edges
+# are from source to destination. Possible edges are found by inquiry at
+# building. Active edges are read at building, then cached until the
+# destination is changed by AvcCcm.set_signal_souarce().
+class AvcCcmGraph():
+    def __init__(self, unit):
+        self.unit = unit
+        self._possible = {}
+        self._reachable = {}
+        self._active = {}
+
+    # Returns the graph built for the unit, or None.
+    @staticmethod
+    def get(unit):
+        return AvcTransport.bind(unit).ccm_graph
+
+    # Plugs of unit and subunits. Destinations are output plugs of unit and
+    # input plugs of subunits, and sources are the counter ones. Subunits
+    # are a list of (type, id).
+    @staticmethod
+    def get_candidates(unit, subunits=()):
+        dsts = []
+        srcs = []
+        for type, plugs in AvcConnection.get_unit_plug_info(unit).items():
+            for i in range(min(plugs['output'], 30)):
+                dsts.append(AvcCcm.get_unit_signal_addr(type, i))
+            for i in range(min(plugs['input'], 30)):
+                srcs.append(AvcCcm.get_unit_signal_addr(type, i))
+        for type, id in subunits:
+            plugs = AvcConnection.get_subunit_plug_info(unit, type, id)
+            for i in range(min(plugs['input'], 30)):
+                dsts.append(AvcCcm.get_subunit_signal_addr(type, id, i))
+            for i in range(min(plugs['output'], 30)):
+                srcs.append(AvcCcm.get_subunit_signal_addr(type, id, i))
+        return dsts, srcs
+
+    # All of inquiries for pairs of source and destination are issued in
+    # pipeline. The graph is kept for the unit.
+    @staticmethod
+    def build(unit, dsts, srcs):
+        graph = AvcCcmGraph(unit)
+        dsts = [bytes(dst) for dst in dsts]
+        srcs = [bytes(src) for src in srcs]
+        inquiries = []
+        statuses = []
+        pipeline = AvcPipeline.get(unit)
+        for dst in dsts:
+            args = AvcCcm._signal_source_frame.build(0x01, 0xff, 0xff,
+                                                     0xfe, dst[0], dst[1])
+            statuses.append((dst, pipeline.transact(args)))
+            for src in srcs:
+                args = AvcCcm._signal_source_frame.build(0x02, 0xff,
+                                        src[0], src[1], dst[0], dst[1])
+                inquiries.append((src, dst, pipeline.transact(args)))
+        for dst in dsts:
+            graph._possible[dst] = []
+        for src in srcs:
+            graph._reachable[src] = []
+        for src, dst, future in inquiries:
+            if future.result()[0] == 0x0c:
+                graph._possible[dst].append(src)
+                graph._reachable[src].append(dst)
+        for dst, future in statuses:
+            graph._active[dst] = AvcCcmGraph._parse_source(future.result())
+        AvcTransport.bind(unit).ccm_graph = graph
+        return graph
+
+    def get_destinations(self):
+        return list(self._possible)
+
+    # Which sources can feed the destination.
+    def get_sources(self, dst):
+        return list(self._possible.get(bytes(dst), ()))
+
+    # Which destinations the source can feed.
+    def get_reachable(self, src):
+        return list(self._reachable.get(bytes(src), ()))
+
+    # What is currently feeding the destination, or None.
+    def get_active_source(self, dst):
+        dst = bytes(dst)
+        if dst not in self._active:
+            args = AvcCcm._signal_source_frame.build(0x01, 0xff, 0xff, 0xfe,
+                                                     dst[0], dst[1])
+            params = AvcGeneral.transact(self.unit, args)
+            self._active[dst] = AvcCcmGraph._parse_source(params)
+        return self._active[dst]
+
+    # Which destinations the source is currently feeding.
+    def get_active_destinations(self, src):
+        src = bytes(src)
+        return [dst for dst in self._possible
+                if self.get_active_source(dst) == src]
+
+    def invalidate(self, dst=None):
+        if dst is None:
+            self._active.clear()
+        else:
+            self._active.pop(bytes(dst), None)
+
+    @staticmethod
+    def _parse_source(params):
+        if params[0] != 0x0c or (params[4] == 0xff and params[5] == 0xfe):
+            return None
+        return bytes(params[4:6])
+
+# Apply a routing table at once. The table is a list of (source,
+# destination). Only routes different from the current ones are sent, and
+# routes into a subunit go before routes from the subunit. When the unit
+# rejects one of them or the transaction fails, e.g. timeout, the routes
+# already sent are restored in reverse order, then the error is raised. A
+# destination of which the previous source is unknown is left as it is at
+# rollback.
+class AvcCcmRouting():
+    @staticmethod
+    def apply(unit, table):
+        table = {bytes(dst): bytes(src) for src, dst in table}
+        current = AvcCcmRouting.get_sources(unit, list(table))
+        routes = [(src, dst) for dst, src in table.items()
+                  if current[dst] != src]
+        applied = []
+        try:
+            for src, dst in AvcCcmRouting.sort(routes):
+                AvcCcm.set_signal_souarce(unit, src, dst)
+                applied.append((current[dst], dst))
+        except Exception:
+            for src, dst in reversed(applied):
+                if src is None:
+                    continue
+                try:
+                    AvcCcm.set_signal_souarce(unit, src, dst)
+                except OSError:
+                    pass
+            raise
+        return {
+            'requested':    len(table),
+            'sent':         len(applied),
+            'avoided':      len(table) - len(applied),
+        }
+
+    # Returns current sources of the destinations, from the graph of the
+    # unit if built, else from the unit in pipeline.
+    @staticmethod
+    def get_sources(unit, dsts):
+        graph = AvcCcmGraph.get(unit)
+        if graph is not None:
+            return {dst: graph.get_active_source(dst) for dst in dsts}
+        futures = []
+        pipeline = AvcPipeline.get(unit)
+        for dst in dsts:
+            args = AvcCcm._signal_source_frame.build(0x01, 0xff, 0xff,
+                                                     0xfe, dst[0], dst[1])
+            futures.append((dst, pipeline.transact(args)))
+        return {dst: AvcCcmGraph._parse_source(future.result())
+                for dst, future in futures}
+
+    # A route into a subunit goes before routes from the subunit. Routes in
+    # a loop keep the given order.
+    @staticmethod
+    def sort(routes):
+        pending = list(routes)
+        ordered = []
+        while len(pending) > 0:
+            for route in pending:
+                src = route[0]
+                if src[0] == 0xff or \
+                   not any(dst[0] == src[0] for s, dst in pending
+                           if (s, dst) != route):
+                    break
+            else:
+                route = pending[0]
+            pending.remove(route)
+            ordered.append(route)
+        return ordered
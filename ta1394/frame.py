@@ -0,0 +1,47 @@
+from struct import Struct
+
+# A frame template is declared once with a fixed layout. Each item in the
+# layout is an integer for a fixed byte, a name for a patchable byte, or a
+# pair of a name and a struct code for a wider patchable field, e.g.
+# ('volume', 'H') for a 16-bit value in big endian.
+class AvcFrame():
+    def __init__(self, *layout):
+        fmt = '>'
+        values = []
+        slots = []
+        names = []
+        for item in layout:
+            if isinstance(item, int):
+                fmt += 'B'
+                values.append(item)
+                continue
+            if isinstance(item, tuple):
+                name, code = item
+            else:
+                name, code = item, 'B'
+            fmt += code
+            slots.append(len(values))
+            names.append(name)
+            values.append(0)
+        self._struct = Struct(fmt)
+        self._values = values
+        self._slots = tuple(slots)
+        self.fields = tuple(names)
+        self.size = self._struct.size
+
+    # Patchable fields are given in the order of the layout.
+    def build(self, *fields):
+        return self._struct.pack(*self._fill(fields))
+
+    # For callers who reuse their own preallocated buffer.
+    def pack_into(self, buf, *fields):
+        self._struct.pack_into(buf, 0, *self._fill(fields))
+        return buf
+
+    def _fill(self, fields):
+        if len(fields) != len(self._slots):
+            raise ValueError('Invalid number of fields for the frame')
+        values = self._values.copy()
+        for slot, field in zip(self._slots, fields):
+            values[slot] = field
+        return values
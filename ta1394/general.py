@@ -1,4 +1,8 @@
-from gi.repository import Hinawa
+from time import perf_counter
+
+from ta1394.frame import AvcFrame
+from ta1394.transport import AvcTransport
+from ta1394.identity import AvcIdentityCache
 
 class AvcGeneral():
     plug_direction = ('output', 'input')
@@ -7,64 +11,60 @@ class AvcGeneral():
                      'reserved', 'panel', 'bulletin-board', 'camera storate',
                      'music')
 
+    _plug_direction_ids = {d: i for i, d in enumerate(plug_direction)}
+    _subunit_type_ids = {t: i for i, t in enumerate(subunit_types)}
+
+    _unit_info_frame = AvcFrame(0x01, 0xff, 0x30, 0xff, 0xff, 0xff, 0xff, 0xff)
+    _subunit_info_frame = AvcFrame(0x01, 0xff, 0x31, 'page', 0xff, 0xff, 0xff,
+                                   0xff)
+    # Company ID and dependent fields follow.
+    _vendor_dependent_frame = AvcFrame('ctype', 0xff, 0x00)
+
     @staticmethod
     def command_control(unit, cmd):
-        if isinstance(unit, Hinawa.SndUnit):
-            params = unit.fcp_transact(cmd)
-        elif isinstance(unit, Hinawa.FwFcp):
-            params = unit.transact(cmd)
-        else:
-            raise ValueError('Invalid argument for SndUnit')
-        if   params[0] == 0x08:
-            raise OSError('Not implemented')
-        elif params[0] == 0x0a:
-            raise OSError('Rejected')
-        elif params[0] != 0x09:
-            raise OSError('Unknown status')
-        return params
+        return AvcGeneral._command(unit, cmd, 0x09)
 
     @staticmethod
     def command_status(unit, cmd):
-        if isinstance(unit, Hinawa.SndUnit):
-            params = unit.fcp_transact(cmd)
-        elif isinstance(unit, Hinawa.FwFcp):
-            params = unit.transact(cmd)
-        else:
-            raise ValueError('Invalid argument for SndUnit')
-        if   params[0] == 0x08:
-            raise OSError('Not implemented')
-        elif params[0] == 0x0a:
-            raise OSError('Rejected')
-        elif params[0] == 0x0b:
-            raise OSError('In transition')
-        elif params[0] != 0x0c:
-            raise OSError('Unknown status')
-        return params
+        return AvcGeneral._command(unit, cmd, 0x0c)
 
     @staticmethod
     def command_inquire(unit, cmd):
-        if isinstance(unit, Hinawa.SndUnit):
-            params = unit.fcp_transact(cmd)
-        elif isinstance(unit, Hinawa.FwFcp):
-            params = unit.transact(cmd)
+        return AvcGeneral._command(unit, cmd, 0x0c)
+
+    @staticmethod
+    def _command(unit, cmd, expected):
+        params = AvcGeneral.transact(unit, cmd)
+        if params[0] != expected:
+            raise OSError(AvcTransport.status_message(params))
+        return params
+
+    # Returns the response frame without checking its status, for callers
+    # who take the status as data.
+    @staticmethod
+    def transact(unit, cmd):
+        transport = AvcTransport.bind(unit)
+        statistics = transport.statistics
+        if statistics is None:
+            params = transport.request(cmd)
         else:
-            raise ValueError('Invalid argument for SndUnit')
-        if   params[0] == 0x08:
-            raise OSError('Not Implemented')
-        elif params[0] != 0x0c:
-            raise OSError('Unknown status')
+            begin = perf_counter()
+            try:
+                params = transport.request(cmd)
+            except Exception as e:
+                statistics.record_error(cmd, e, perf_counter() - begin)
+                raise
+            statistics.record(cmd, params, perf_counter() - begin)
+        return params
 
     @staticmethod
     def get_unit_info(unit):
-        args = bytearray()
-        args.append(0x01)
-        args.append(0xff)
-        args.append(0x30)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
+        return AvcIdentityCache.query(unit, ('unit-info', ),
+                                      AvcGeneral._get_unit_info)
+
+    @staticmethod
+    def _get_unit_info(unit):
+        args = AvcGeneral._unit_info_frame.build()
         params = AvcGeneral.command_status(unit, args)
         info = {}
         info['unit-type'] = params[4] >> 3
@@ -76,15 +76,12 @@ class AvcGeneral():
     def get_subunit_info(unit, page):
         if page > 7:
             raise ValueError('Invalid argument for page number')
-        args = bytearray()
-        args.append(0x01)
-        args.append(0xff)
-        args.append(0x31)
-        args.append(page << 4 | 0x07)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
+        return AvcIdentityCache.query(unit, ('subunit-info', page),
+                                      AvcGeneral._get_subunit_info, page)
+
+    @staticmethod
+    def _get_subunit_info(unit, page):
+        args = AvcGeneral._subunit_info_frame.build(page << 4 | 0x07)
         params = AvcGeneral.command_status(unit, args)
         info = {}
         info['subunit-type'] = AvcGeneral.subunit_types[params[4] >> 3]
@@ -98,14 +95,9 @@ class AvcGeneral():
             raise ValueError('Invalid array for company ID')
         if len(deps) == 0:
             raise ValueError('Invalid data for vendor dependent field')
-        args = bytearray()
-        args.append(0x00)   # Control
-        args.append(0xff)   # Unit
-        args.append(0x00)   # Vendor dependent command
-        for b in company_ids:
-            args.append(b)
-        for b in deps:
-            args.append(b)
+        # Control, unit, vendor dependent command
+        args = AvcGeneral._vendor_dependent_frame.build(0x00) + \
+               bytes(company_ids) + bytes(deps)
         AvcGeneral.command_control(unit, args)
 
     @staticmethod
@@ -114,31 +106,33 @@ class AvcGeneral():
             raise ValueError('Invalid array for company ID')
         if len(deps) == 0:
             raise ValueError('Invalid data for vendor dependent field')
-        args = bytearray()
-        args.append(0x01)
-        args.append(0xff)
-        args.append(0x00)
-        for b in company_ids:
-            args.append(b)
-        for b in deps:
-            args.append(b)
+        args = AvcGeneral._vendor_dependent_frame.build(0x01) + \
+               bytes(company_ids) + bytes(deps)
         params = AvcGeneral.command_status(unit, args)
         return params[6:]
 
 class AvcConnection():
     sampling_rates = (32000, 44100, 48000, 88200, 96000, 176400, 192000)
 
+    _sampling_rate_ids = {r: i for i, r in enumerate(sampling_rates)}
+
+    # Serial Bus Isochronous and External Plug
+    _unit_plug_info_frame = AvcFrame(0x01, 0xff, 0x02, 0x00, 0xff, 0xff, 0xff,
+                                     0xff)
+    _subunit_plug_info_frame = AvcFrame(0x01, 'subunit', 0x02, 0x00, 0xff,
+                                        0xff, 0xff, 0xff)
+    # Opcode is 0x18 for output plug and 0x19 for input plug.
+    _plug_signal_format_frame = AvcFrame('ctype', 0xff, 'opcode', 'plug',
+                                         'fmt', 'fdf', 0xff, 0xff)
+
     @staticmethod
     def get_unit_plug_info(unit):
-        args = bytearray()
-        args.append(0x01)
-        args.append(0xff)
-        args.append(0x02)   # Plug info
-        args.append(0x00)   # Serial Bus Isochronous and External Plug
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
+        return AvcIdentityCache.query(unit, ('unit-plug-info', ),
+                                      AvcConnection._get_unit_plug_info)
+
+    @staticmethod
+    def _get_unit_plug_info(unit):
+        args = AvcConnection._unit_plug_info_frame.build()
         params = AvcGeneral.command_status(unit, args)
         return {'isoc': {
                     'input':    params[4],
@@ -149,19 +143,17 @@ class AvcConnection():
 
     @staticmethod
     def get_subunit_plug_info(unit, subunit_type, subunit_id):
-        if AvcGeneral.subunit_types.count(subunit_type) == 0:
+        if subunit_type not in AvcGeneral._subunit_type_ids:
             raise ValueError('Invalid argument for subunit type')
         if subunit_id > 7:
             raise ValueError('Invalid argument for subunit id')
-        args = bytearray()
-        args.append(0x01)
-        args.append((AvcGeneral.subunit_types.index(subunit_type) << 3) | subunit_id)
-        args.append(0x02)
-        args.append(0x00)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
+        subunit = (AvcGeneral._subunit_type_ids[subunit_type] << 3) | subunit_id
+        return AvcIdentityCache.query(unit, ('subunit-plug-info', subunit),
+                                AvcConnection._get_subunit_plug_info, subunit)
+
+    @staticmethod
+    def _get_subunit_plug_info(unit, subunit):
+        args = AvcConnection._subunit_plug_info_frame.build(subunit)
         params = AvcGeneral.command_status(unit, args)
         # Consider that destination is input and source is output.
         return {'input': params[4], 'output': params[5]}
@@ -172,61 +164,53 @@ class AvcConnection():
             raise RuntimeError('Packet streaming is running')
         if plug > 255:
             raise ValueError('Invalid argument for plug number')
-        if AvcGeneral.plug_direction.count(direction) == 0:
+        if direction not in AvcGeneral._plug_direction_ids:
             raise ValueError('Invalid argument for plug direction')
-        if AvcConnection.sampling_rates.count(rate) == 0:
+        if rate not in AvcConnection._sampling_rate_ids:
             raise ValueError('Invalid argument for sampling rate')
-        args = bytearray()
-        args.append(0x00)
-        args.append(0xff)
-        args.append(0x18 + AvcGeneral.plug_direction.index(direction))
-        args.append(plug)
-        args.append(0x90)
-        args.append(AvcGeneral.sampling_rates.index(rate))
-        args.append(0xff)
-        args.append(0xff)
+        args = AvcConnection._plug_signal_format_frame.build(0x00,
+                        0x18 + AvcGeneral._plug_direction_ids[direction], plug,
+                        0x90, AvcConnection._sampling_rate_ids[rate])
         params = AvcGeneral.command_control(unit, args)
 
     @staticmethod
     def get_plug_signal_format(unit, direction, plug):
         if plug > 255:
             raise ValueError('Invalid argument for plug number')
-        if AvcGeneral.plug_direction.count(direction) == 0:
+        if direction not in AvcGeneral._plug_direction_ids:
             raise ValueError('Invalid argument for plug direction')
-        args = bytearray()
-        args.append(0x01)
-        args.append(0xff)
-        args.append(0x18 + AvcGeneral.plug_direction.index(direction))
-        args.append(plug)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
+        args = AvcConnection._plug_signal_format_frame.build(0x01,
+                        0x18 + AvcGeneral._plug_direction_ids[direction], plug,
+                        0xff, 0xff)
         params = AvcGeneral.command_status(unit, args)
-        param = params[5] & 0x03
-        if param > len(AvcConnection.sampling_rates):
-            raise OSError
+        return AvcConnection.parse_plug_signal_format(params)
+
+    # The lower 3 bits of FDF for AM824 is the code of sampling frequency.
+    @staticmethod
+    def parse_plug_signal_format(params):
+        param = params[5] & 0x07
+        if param >= len(AvcConnection.sampling_rates):
+            raise OSError('Unexpected sampling frequency in response')
         return AvcConnection.sampling_rates[param]
 
     @staticmethod
     def ask_plug_signal_format(unit, direction, plug, rate): 
         if plug > 255:
             raise ValueError('Invalid argument for plug number')
-        if AvcGeneral.plug_direction.count(direction) == 0:
+        if direction not in AvcGeneral._plug_direction_ids:
             raise ValueError('Invalid argument for plug direction')
-        if AvcConnection.sampling_rates.count(rate) == 0:
+        if rate not in AvcConnection._sampling_rate_ids:
             raise ValueError('Invalid argument for sampling rate')
-        args = bytearray()
-        args.append(0x02)
-        args.append(0xff)
-        args.append(0x18 + AvcGeneral.plug_direction.index(direction))
-        args.append(plug)
-        args.append(0x90)
-        args.append(AvcConnection.sampling_rates.index(rate))
-        args.append(0xff)
-        args.append(0xff)
+        args = AvcConnection._plug_signal_format_frame.build(0x02,
+                        0x18 + AvcGeneral._plug_direction_ids[direction], plug,
+                        0x90, AvcConnection._sampling_rate_ids[rate])
         try:
             AvcGeneral.command_inquire(unit, args)
         except OSError:
             return False
         return True
+
+    @staticmethod
+    def get_sampling_rates_from_mask(mask):
+        return [rate for i, rate in enumerate(AvcConnection.sampling_rates)
+                if mask & (1 << i)]
@@ -0,0 +1,56 @@
+from copy import deepcopy
+
+from ta1394.transport import AvcTransport
+
+# Unit and subunit identities never change while a device is connected. They
+# are cached per GUID of device and invalidated by bus reset. Units without
+# GUID are not cached.
+class AvcIdentityCache():
+    _entries = {}
+
+    # Hinawa.SndUnit has GUID in its property. For the others, e.g. FwFcp,
+    # give GUID and the node which emits 'bus-update' signal.
+    @staticmethod
+    def attach(unit, guid, node=None):
+        transport = AvcTransport.bind(unit)
+        transport.guid = guid
+        if node is not None:
+            AvcIdentityCache._watch(node, guid)
+
+    @staticmethod
+    def get_guid(unit):
+        transport = AvcTransport.bind(unit)
+        if transport.guid is None and not transport.guid_probed:
+            transport.guid_probed = True
+            try:
+                transport.guid = unit.get_property('guid')
+            except (AttributeError, TypeError):
+                return None
+            AvcIdentityCache._watch(unit, transport.guid)
+        return transport.guid
+
+    @staticmethod
+    def invalidate(guid=None):
+        if guid is None:
+            AvcIdentityCache._entries.clear()
+        else:
+            AvcIdentityCache._entries.pop(guid, None)
+
+    # Return the cached result of func(unit, *args) for the key, or call it.
+    @staticmethod
+    def query(unit, key, func, *args):
+        guid = AvcIdentityCache.get_guid(unit)
+        if guid is None:
+            return func(unit, *args)
+        entries = AvcIdentityCache._entries.setdefault(guid, {})
+        if key not in entries:
+            entries[key] = func(unit, *args)
+        return deepcopy(entries[key])
+
+    @staticmethod
+    def _watch(node, guid):
+        try:
+            node.connect('bus-update',
+                         lambda *args: AvcIdentityCache.invalidate(guid))
+        except (AttributeError, TypeError):
+            pass
@@ -0,0 +1,147 @@
+from queue import Empty
+from queue import Queue
+from threading import Lock
+from threading import Thread
+from threading import current_thread
+from concurrent.futures import Future
+
+from ta1394.general import AvcGeneral
+from ta1394.transport import AvcTransport
+
+# A queue of AV/C commands for one unit. Callers can submit many frames at
+# once and go on building or parsing while a worker keeps the transport busy.
+# The worker starts at the first command and exits after idle seconds
+# without commands. Commands issued by a function running in the worker are
+# done at once, since the worker can't wait for itself.
+class AvcPipeline():
+    _dispatchers = {
+        0x00: AvcGeneral.command_control,
+        0x01: AvcGeneral.command_status,
+        0x02: AvcGeneral.command_inquire,
+    }
+
+    _lock = Lock()
+
+    def __init__(self, unit, depth=32, idle=1.0):
+        if depth < 1:
+            raise ValueError('Invalid argument for depth of queue')
+        self._unit = unit
+        self._queue = Queue(depth)
+        self._idle = idle
+        self._closed = False
+        self._worker = None
+        self._worker_lock = Lock()
+
+    # The pipeline shared by helpers and AvcAsyncUnit for the unit. FCP
+    # allows one outstanding transaction per node, thus one worker per unit
+    # is enough. Units kept in the registry of AvcTransport are given to
+    # functions as the transport, so that the pipeline doesn't keep them
+    # alive.
+    @staticmethod
+    def get(unit):
+        transport = AvcTransport.bind(unit)
+        with AvcPipeline._lock:
+            pipeline = transport.pipeline
+            if pipeline is None or pipeline._closed:
+                if getattr(unit, '_avc_transport', None) is not transport:
+                    unit = transport
+                pipeline = AvcPipeline(unit)
+                transport.pipeline = pipeline
+        return pipeline
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Returns a future for the response frame of the given command frame.
+    def submit(self, cmd):
+        if cmd[0] not in AvcPipeline._dispatchers:
+            raise ValueError('Invalid argument for command type')
+        dispatcher = AvcPipeline._dispatchers[cmd[0]]
+        return self._enqueue(AvcPipeline._transact, dispatcher, self._unit,
+                             bytes(cmd))
+
+    def submit_all(self, cmds):
+        return [self.submit(cmd) for cmd in cmds]
+
+    # Returns a future for the response frame without checking its status,
+    # for callers who take the status as data, e.g. results of inquiry.
+    def transact(self, cmd):
+        return self._enqueue(AvcPipeline._transact, AvcGeneral.transact,
+                             self._unit, bytes(cmd))
+
+    # Returns a future for the result of any command function in ta1394 or
+    # bridgeco, e.g. call(AvcAudio.get_feature_volume_state, 0, 'current',
+    # fb_id, ch).
+    def call(self, func, *args):
+        return self._enqueue(func, self._unit, *args)
+
+    def map(self, func, arg_list):
+        return [self.call(func, *args) for args in arg_list]
+
+    def close(self):
+        with self._worker_lock:
+            if self._closed:
+                return
+            self._closed = True
+            worker = self._worker
+            if worker is not None:
+                self._queue.put(None)
+        if worker is not None and worker is not current_thread():
+            worker.join()
+
+    def _enqueue(self, func, *args):
+        future = Future()
+        if current_thread() is self._worker:
+            AvcPipeline._execute(future, func, args)
+            return future
+        with self._worker_lock:
+            if self._closed:
+                raise RuntimeError('Pipeline is already closed')
+            if self._worker is None:
+                self._worker = Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._queue.put((future, func, args))
+        return future
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self._idle)
+            except Empty:
+                with self._worker_lock:
+                    if self._queue.empty():
+                        self._worker = None
+                        return
+                continue
+            if item is None:
+                break
+            AvcPipeline._execute(*item)
+
+    @staticmethod
+    def _execute(future, func, args):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    @staticmethod
+    def _transact(dispatcher, unit, cmd):
+        params = dispatcher(unit, cmd)
+        if not AvcPipeline.match(cmd, params):
+            raise OSError('Unexpected response for the command')
+        return params
+
+    # The response has the same subunit and opcode as the command, and the
+    # first operand unless the command leaves it to be filled by the target.
+    @staticmethod
+    def match(cmd, params):
+        if len(params) < 3 or params[1] != cmd[1] or params[2] != cmd[2]:
+            return False
+        if len(cmd) > 3 and cmd[3] != 0xff:
+            return len(params) > 3 and params[3] == cmd[3]
+        return True
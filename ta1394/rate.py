@@ -0,0 +1,139 @@
+from time import monotonic
+from time import sleep
+
+from ta1394.general import AvcGeneral
+from ta1394.general import AvcConnection
+from ta1394.identity import AvcIdentityCache
+from ta1394.pipeline import AvcPipeline
+from ta1394.transport import AvcRetryPolicy
+
+# Change sampling rate of isochronous plugs. The plan is the minimal set of
+# control commands: plugs which don't support the rate and plugs which are
+# already at the rate are skipped. Input plugs are changed before output
+# plugs, as ALSA BeBoB driver does. Then the signal format of the changed
+# plugs is polled with backoff until all of them report the rate.
+class AvcRateChange():
+    # The delay of polling starts at 1 msec and is up to 50 msec.
+    poll_policy = AvcRetryPolicy(delay=0.001, max_delay=0.05, jitter=0.25)
+
+    # The order of directions to change.
+    _directions = ('input', 'output')
+
+    # The capabilities are bitmasks of sampling rates per direction and plug,
+    # from get_capabilities() or AvcStreamFormatIndex.get_rate_masks() for
+    # the known formats. Returns a list of (direction, plug).
+    @staticmethod
+    def plan(unit, rate, caps=None):
+        if rate not in AvcConnection._sampling_rate_ids:
+            raise ValueError('Invalid argument for sampling rate')
+        if caps is None:
+            caps = AvcRateChange.get_capabilities(unit)
+        bit = 1 << AvcConnection._sampling_rate_ids[rate]
+        candidates = []
+        for direction in AvcRateChange._directions:
+            for plug, mask in enumerate(caps.get(direction, ())):
+                if mask & bit:
+                    candidates.append((direction, plug))
+        if len(candidates) == 0:
+            raise ValueError('Invalid argument for sampling rate')
+        current = AvcRateChange.get_rates(unit, candidates)
+        return [(direction, plug) for direction, plug in candidates
+                if current[(direction, plug)] != rate]
+
+    # Returns bitmasks of supported sampling rates for each isochronous plug,
+    # e.g. {'input': [mask, ...], 'output': [mask, ...]}. The bit n stands
+    # for AvcConnection.sampling_rates[n]. All of inquiries are issued in
+    # pipeline and the result is cached per device.
+    @staticmethod
+    def get_capabilities(unit):
+        return AvcIdentityCache.query(unit, ('signal-format-capabilities', ),
+                                      AvcRateChange._get_capabilities)
+
+    @staticmethod
+    def _get_capabilities(unit):
+        plugs = AvcConnection.get_unit_plug_info(unit)['isoc']
+        futures = []
+        pipeline = AvcPipeline.get(unit)
+        for direction, count in plugs.items():
+            for plug in range(count):
+                for i in range(len(AvcConnection.sampling_rates)):
+                    args = AvcRateChange._build(0x02, direction, plug, 0x90, i)
+                    futures.append((direction, plug, i,
+                                    pipeline.transact(args)))
+        caps = {direction: [0] * count for direction, count in plugs.items()}
+        for direction, plug, i, future in futures:
+            if future.result()[0] == 0x0c:
+                caps[direction][plug] |= 1 << i
+        return caps
+
+    # Returns the current rate of the plugs, or None for the plug which
+    # doesn't report it. The status commands are issued in pipeline.
+    @staticmethod
+    def get_rates(unit, plugs):
+        futures = []
+        pipeline = AvcPipeline.get(unit)
+        for direction, plug in plugs:
+            args = AvcRateChange._build(0x01, direction, plug, 0xff, 0xff)
+            futures.append(((direction, plug), pipeline.transact(args)))
+        rates = {}
+        for key, future in futures:
+            params = future.result()
+            rates[key] = None
+            if params[0] == 0x0c:
+                try:
+                    rates[key] = AvcConnection.parse_plug_signal_format(params)
+                except OSError:
+                    pass
+        return rates
+
+    # Returns a report of the change. The elapsed time is in seconds.
+    @staticmethod
+    def change(unit, rate, caps=None, timeout=2.0):
+        if AvcRateChange._is_streaming(unit):
+            raise RuntimeError('Packet streaming is running')
+        begin = monotonic()
+        plan = AvcRateChange.plan(unit, rate, caps)
+        for direction, plug in plan:
+            args = AvcRateChange._build(0x00, direction, plug, 0x90,
+                                        AvcConnection._sampling_rate_ids[rate])
+            AvcGeneral.command_control(unit, args)
+        polls = AvcRateChange._wait(unit, rate, plan, begin + timeout)
+        return {
+            'rate':     rate,
+            'commands': len(plan),
+            'polls':    polls,
+            'elapsed':  monotonic() - begin,
+        }
+
+    @staticmethod
+    def _wait(unit, rate, plugs, deadline):
+        polls = 0
+        attempt = 0
+        while len(plugs) > 0:
+            current = AvcRateChange.get_rates(unit, plugs)
+            polls += 1
+            plugs = [key for key in plugs if current[key] != rate]
+            if len(plugs) == 0:
+                break
+            delay = AvcRateChange.poll_policy.backoff(attempt)
+            if monotonic() + delay > deadline:
+                raise TimeoutError('Sampling rate is not stable')
+            sleep(delay)
+            attempt += 1
+        return polls
+
+    @staticmethod
+    def _build(ctype, direction, plug, fmt, fdf):
+        if plug > 255:
+            raise ValueError('Invalid argument for plug number')
+        return AvcConnection._plug_signal_format_frame.build(ctype,
+                        0x18 + AvcGeneral._plug_direction_ids[direction], plug,
+                        fmt, fdf)
+
+    # Hinawa.SndUnit has the property. The others are not for ALSA.
+    @staticmethod
+    def _is_streaming(unit):
+        try:
+            return unit.get_property('streaming') is True
+        except (AttributeError, TypeError):
+            return False
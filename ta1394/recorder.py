@@ -0,0 +1,142 @@
+from errno import ETIMEDOUT
+from struct import Struct
+from time import monotonic
+from time import sleep
+from collections import deque
+from threading import Lock
+
+from ta1394.transport import AvcTransport
+
+# A compact binary log of transactions. The file starts with magic and
+# version, then each record has a header and two frames:
+#  - kind of transaction (0: FCP, 1: EFW)
+#  - result (0: response, 1: timeout, 2: the other error)
+#  - time since the log starts, in seconds
+#  - time for the transaction, in seconds
+#  - the length of request frame and of response frame
+# For errors, the response frame has the message of error.
+class TransactionLog():
+    magic = b'HNWL'
+    version = 1
+
+    kinds = ('fcp', 'efw')
+    results = ('response', 'timeout', 'error')
+
+    _header = Struct('>4sB')
+    _record = Struct('>BBddII')
+
+    _lock = Lock()
+
+    @staticmethod
+    def open_writer(path):
+        fp = open(path, 'wb')
+        fp.write(TransactionLog._header.pack(TransactionLog.magic,
+                                             TransactionLog.version))
+        return fp
+
+    @staticmethod
+    def write(fp, kind, result, timestamp, latency, request, response):
+        header = TransactionLog._record.pack(TransactionLog.kinds.index(kind),
+                        TransactionLog.results.index(result), timestamp,
+                        latency, len(request), len(response))
+        with TransactionLog._lock:
+            fp.write(header + request + response)
+
+    @staticmethod
+    def get_result(e):
+        if isinstance(e, TimeoutError) or \
+           getattr(e, 'code', None) == ETIMEDOUT:
+            return 'timeout'
+        return 'error'
+
+    # Yields (kind, result, timestamp, latency, request, response).
+    @staticmethod
+    def read(path):
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        magic, version = TransactionLog._header.unpack_from(data, 0)
+        if magic != TransactionLog.magic or version != TransactionLog.version:
+            raise ValueError('Unsupported file for transaction log')
+        pos = TransactionLog._header.size
+        while pos < len(data):
+            kind, result, timestamp, latency, req_len, resp_len = \
+                                TransactionLog._record.unpack_from(data, pos)
+            pos += TransactionLog._record.size
+            request = data[pos:pos + req_len]
+            pos += req_len
+            response = data[pos:pos + resp_len]
+            pos += resp_len
+            yield (TransactionLog.kinds[kind], TransactionLog.results[result],
+                   timestamp, latency, request, response)
+
+# Serve recorded responses for the same requests, in recorded order for
+# each request. When realtime is True, responses arrive at the recorded
+# timing relative to the first request, thus the gaps between transactions
+# are replayed as well as the time for each, else it returns immediately.
+class TransactionReplayer():
+    def __init__(self, path, kind, realtime=False):
+        self.realtime = realtime
+        self._entries = {}
+        self._first = None
+        self._origin = None
+        for entry in TransactionLog.read(path):
+            if entry[0] != kind:
+                continue
+            if self._first is None:
+                self._first = entry[2]
+            request = entry[4]
+            if request not in self._entries:
+                self._entries[request] = deque()
+            self._entries[request].append(entry[1:4] + entry[5:])
+
+    def _replay(self, request):
+        entries = self._entries.get(bytes(request))
+        if not entries:
+            raise OSError('No recorded response for the request')
+        result, timestamp, latency, response = entries.popleft()
+        if self.realtime:
+            if self._origin is None:
+                self._origin = monotonic()
+            wait = self._origin + timestamp - self._first + latency - \
+                   monotonic()
+            if wait > 0:
+                sleep(wait)
+        if result == 'timeout':
+            raise TimeoutError(response.decode())
+        elif result == 'error':
+            raise OSError(response.decode())
+        return response
+
+    def get_remainders(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+# Wrap a unit or FCP handle, then use it instead of the unit.
+class FcpRecorder():
+    def __init__(self, unit, path):
+        self._transport = AvcTransport.bind(unit)
+        self._fp = TransactionLog.open_writer(path)
+        self._begin = monotonic()
+
+    def transact(self, cmd):
+        begin = monotonic()
+        try:
+            params = self._transport.transact(cmd)
+        except Exception as e:
+            result = TransactionLog.get_result(e)
+            TransactionLog.write(self._fp, 'fcp', result, begin - self._begin,
+                                 monotonic() - begin, bytes(cmd),
+                                 str(e).encode())
+            raise
+        TransactionLog.write(self._fp, 'fcp', 'response', begin - self._begin,
+                             monotonic() - begin, bytes(cmd), bytes(params))
+        return params
+
+    def close(self):
+        self._fp.close()
+
+class FcpReplayer(TransactionReplayer):
+    def __init__(self, path, realtime=False):
+        super().__init__(path, 'fcp', realtime)
+
+    def transact(self, cmd):
+        return bytearray(self._replay(cmd))
@@ -0,0 +1,136 @@
+import json
+from threading import Lock
+
+from ta1394.transport import AvcTransport
+
+# A histogram with logarithmic buckets, each of which is divided linearly as
+# HdrHistogram does. With 4 bits, the error of recorded value is up to 1/8.
+class AvcHistogram():
+    def __init__(self, sub_bits=4):
+        if sub_bits < 1:
+            raise ValueError('Invalid argument for sub-bucket bits')
+        self._sub_bits = sub_bits
+        self._buckets = {}
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+
+    # In micro seconds.
+    def record(self, value):
+        value = int(value)
+        shift = max(value.bit_length() - self._sub_bits, 0)
+        index = (shift << self._sub_bits) | (value >> shift)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def get_buckets(self):
+        mask = (1 << self._sub_bits) - 1
+        return [((index & mask) << (index >> self._sub_bits), count)
+                for index, count in sorted(self._buckets.items())]
+
+    def get_percentile(self, percentile):
+        if self.count == 0:
+            return None
+        threshold = self.count * percentile / 100
+        seen = 0
+        for lower, count in self.get_buckets():
+            seen += count
+            if seen >= threshold:
+                return lower
+        return self.maximum
+
+    def as_dict(self):
+        info = {}
+        info['count'] = self.count
+        info['minimum'] = self.minimum
+        info['maximum'] = self.maximum
+        if self.count > 0:
+            info['mean'] = self.total / self.count
+        else:
+            info['mean'] = None
+        for percentile in (50, 90, 99):
+            info['p{0}'.format(percentile)] = self.get_percentile(percentile)
+        info['buckets'] = self.get_buckets()
+        return info
+
+# Per-unit counters for AV/C commands, keyed by opcode and ctype. Nothing is
+# recorded until enabled for the unit. Commands are recorded by any thread,
+# e.g. the worker of AvcPipeline, thus the entries are guarded by lock.
+class AvcStatistics():
+    def __init__(self):
+        self._entries = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def enable(unit):
+        transport = AvcTransport.bind(unit)
+        if transport.statistics is None:
+            transport.statistics = AvcStatistics()
+        return transport.statistics
+
+    @staticmethod
+    def disable(unit):
+        transport = AvcTransport.bind(unit)
+        statistics = transport.statistics
+        transport.statistics = None
+        return statistics
+
+    @staticmethod
+    def get(unit):
+        return AvcTransport.bind(unit).statistics
+
+    def record(self, cmd, params, elapsed):
+        status = AvcTransport.decode_status(params)
+        with self._lock:
+            entry = self._get_entry(cmd)
+            entry['count'] += 1
+            entry['responses'][status] = entry['responses'].get(status, 0) + 1
+            entry['latency'].record(elapsed * 1000000)
+
+    def record_error(self, cmd, e, elapsed):
+        with self._lock:
+            entry = self._get_entry(cmd)
+            entry['count'] += 1
+            entry['errors'] += 1
+            entry['latency'].record(elapsed * 1000000)
+
+    def _get_entry(self, cmd):
+        key = (cmd[2], cmd[0])
+        if key not in self._entries:
+            self._entries[key] = {
+                'count':        0,
+                'errors':       0,
+                'responses':    {},
+                'latency':      AvcHistogram(),
+            }
+        return self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    def as_dict(self):
+        opcodes = {}
+        with self._lock:
+            for (opcode, ctype), entry in sorted(self._entries.items()):
+                name = '0x{0:02x}'.format(opcode)
+                if name not in opcodes:
+                    opcodes[name] = {}
+                opcodes[name][AvcTransport.ctypes.get(ctype, 'reserved')] = {
+                    'count':        entry['count'],
+                    'errors':       entry['errors'],
+                    'responses':    dict(entry['responses']),
+                    'latency':      entry['latency'].as_dict(),
+                }
+        return opcodes
+
+    def dump_json(self, fp=None):
+        if fp is None:
+            return json.dumps(self.as_dict())
+        json.dump(self.as_dict(), fp)
@@ -1,4 +1,9 @@
+from bisect import bisect_left
+
 from ta1394.general import AvcGeneral
+from ta1394.general import AvcConnection
+from ta1394.frame import AvcFrame
+from ta1394.transport import AvcTransport
 
 class AvcStreamFormatInfo():
     hierarchy_roots = ('DVCR', 'Audio&Music', 'BT.601', 'invalid', 'reserved')
@@ -30,25 +35,18 @@ class AvcStreamFormatInfo():
              'do-not-care',     # 0xff
              'reserved')        # the others
 
+    # Subfunction is 0xc0 for single request and 0xc1 for list request.
+    _format_frame = AvcFrame(0x01, 0xff, 0xbf, 'subfunction', 'direction',
+                             0x00, 0x00, 'plug', 0xff, 0xff, 'index', 0xff)
+
     @staticmethod
     def get_format(unit, direction, plug):
-        if AvcGeneral.plug_direction.count(direction) == 0:
+        if direction not in AvcGeneral._plug_direction_ids:
             raise ValueError('Invalid argument for plug direction')
         if plug > 255:
             raise ValueError('Invalid argument for plug number')
-        args = bytearray()
-        args.append(0x01)
-        args.append(0xff)
-        args.append(0xbf)
-        args.append(0xc0)
-        args.append(AvcGeneral.plug_direction.index(direction))
-        args.append(0x00)
-        args.append(0x00)
-        args.append(plug)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0xff)
+        args = AvcStreamFormatInfo._format_frame.build(0xc0,
+                        AvcGeneral._plug_direction_ids[direction], plug, 0xff)
         params = AvcGeneral.command_status(unit, args)
 
         return AvcStreamFormatInfo.parse_format(params[10:len(params)])
@@ -57,52 +55,238 @@ class AvcStreamFormatInfo():
     def parse_format(params):
         if params[0] != 0x90 or params[1] != 0x40:
             raise RuntimeError('Unsupported format')
+        rate = AvcStreamFormatInfo.sampling_rates[params[2]]
+        ctl = AvcStreamFormatInfo.rate_controls[params[3] & 0x03]
+        formation = AvcStreamFormat.parse_formation(params[4:])
+        return AvcStreamFormat.get('Compound', rate, ctl, formation)
 
-        fmt = {}
-        fmt['sampling-rate'] = AvcStreamFormatInfo.sampling_rates[params[2]]
-        fmt['rate-control'] = AvcStreamFormatInfo.rate_controls[params[3] & 0x03]
-        formation = []
-        for i in range(params[4]):
-            for c in range(params[5 + i * 2]):
-                type = params[5 + i * 2 + 1]
-                if type <= 0x0f:
-                    formation.append(AvcStreamFormatInfo.types[type])
-                elif type == 0x10:
-                    formation.append('ancillary-data')
-                elif type == 0x40:
-                    formation.append('sync-stream')
-                elif type == 0xff:
-                    formation.append('do-not-care')
-                else:
-                    formation.append('reserved')
-        fmt['formation'] = formation
-        return fmt
+    @staticmethod
+    def get_type_name(code):
+        if code <= 0x0f:
+            return AvcStreamFormatInfo.types[code]
+        elif code == 0x10:
+            return 'ancillary-data'
+        elif code == 0x40:
+            return 'sync-stream'
+        elif code == 0xff:
+            return 'do-not-care'
+        else:
+            return 'reserved'
 
     @staticmethod
     def get_formats(unit, direction, plug):
-        if AvcGeneral.plug_direction.count(direction) == 0:
+        return list(AvcStreamFormatInfo.iterate_formats(unit, direction, plug))
+
+    # Yields parsed formats in the list of the plug as each response arrives.
+    # The list ends with rejected response. Formats which parse_format()
+    # doesn't support, e.g. AM824 sync stream, are yielded as raw bytes. With
+    # limit, it stops after the number of formats are yielded. With
+    # predicate, it yields the parsed formats for which predicate returns
+    # True.
+    @staticmethod
+    def iterate_formats(unit, direction, plug, limit=None, predicate=None):
+        if direction not in AvcGeneral._plug_direction_ids:
             raise ValueError('Invalid argument for plug direction')
         if plug > 255:
             raise ValueError('Invalid argument for plug number')
-        fmts = []
-        args = bytearray()
-        args.append(0x01)
-        args.append(0xff)
-        args.append(0xbf)
-        args.append(0xc1)
-        args.append(AvcGeneral.plug_direction.index(direction))
-        args.append(0x00)
-        args.append(0x00)
-        args.append(plug)
-        args.append(0xff)
-        args.append(0xff)
-        args.append(0x00)
-        args.append(0xff)
+        if limit is not None and limit <= 0:
+            return
+        direction = AvcGeneral._plug_direction_ids[direction]
+        count = 0
         for i in range(255):
-            args[10] = i
+            args = AvcStreamFormatInfo._format_frame.build(0xc1, direction,
+                                                           plug, i)
+            params = AvcGeneral.transact(unit, args)
+            if params[0] == 0x0a:
+                break
+            elif params[0] != 0x0c:
+                raise OSError(AvcTransport.status_message(params))
             try:
-                fmt = AvcGeneral.command_status(unit, args)
-                fmts.append(fmt)
-            except:
+                fmt = AvcStreamFormatInfo.parse_format(params[11:])
+            except RuntimeError:
+                if predicate is not None:
+                    continue
+                fmt = bytes(params[11:])
+            else:
+                if predicate is not None and not predicate(fmt):
+                    continue
+            yield fmt
+            count += 1
+            if limit is not None and count >= limit:
                 break
-        return fmts
+
+# An immutable stream format. The formation is run-length encoded as pairs of
+# data type code and the number of channels. Formats are interned, thus the
+# same format across plugs is the same instance.
+class AvcStreamFormat():
+    __slots__ = ('type', 'sampling_rate', 'rate_control', 'formation',
+                 '_hash')
+
+    _interned = {}
+
+    _keys = ('type', 'sampling-rate', 'rate-control', 'formation')
+
+    def __init__(self, type, sampling_rate, rate_control, formation):
+        object.__setattr__(self, 'type', type)
+        object.__setattr__(self, 'sampling_rate', sampling_rate)
+        object.__setattr__(self, 'rate_control', rate_control)
+        object.__setattr__(self, 'formation', formation)
+        object.__setattr__(self, '_hash',
+                    hash((type, sampling_rate, rate_control, formation)))
+
+    @staticmethod
+    def get(type, sampling_rate, rate_control, formation):
+        key = (type, sampling_rate, rate_control, tuple(formation))
+        fmt = AvcStreamFormat._interned.get(key)
+        if fmt is None:
+            fmt = AvcStreamFormat(*key)
+            fmt = AvcStreamFormat._interned.setdefault(key, fmt)
+        return fmt
+
+    # The number of entries, then pairs of the number of channels and data
+    # type code in each entry. Adjacent entries with the same type are merged.
+    @staticmethod
+    def parse_formation(params):
+        runs = []
+        for i in range(params[0]):
+            count = params[1 + i * 2]
+            code = params[2 + i * 2]
+            if count == 0:
+                continue
+            if runs and runs[-1][0] == code:
+                runs[-1] = (code, runs[-1][1] + count)
+            else:
+                runs.append((code, count))
+        return tuple(runs)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Stream format is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Stream format is immutable')
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, AvcStreamFormat):
+            return NotImplemented
+        return self._hash == other._hash and \
+               self.type == other.type and \
+               self.sampling_rate == other.sampling_rate and \
+               self.rate_control == other.rate_control and \
+               self.formation == other.formation
+
+    def __repr__(self):
+        return 'AvcStreamFormat({0!r}, {1}, {2!r}, {3!r})'.format(self.type,
+                    self.sampling_rate, self.rate_control, self.formation)
+
+    # The number of channels, of the data type code if given.
+    def get_channels(self, code=None):
+        return sum(count for c, count in self.formation
+                   if code is None or c == code)
+
+    def get_channel_names(self):
+        names = []
+        for code, count in self.formation:
+            names.extend([AvcStreamFormatInfo.get_type_name(code)] * count)
+        return names
+
+    # The same keys as the dictionary of formats in previous versions.
+    def __getitem__(self, key):
+        if key == 'type':
+            return self.type
+        elif key == 'sampling-rate':
+            return self.sampling_rate
+        elif key == 'rate-control':
+            return self.rate_control
+        elif key == 'formation':
+            return self.get_channel_names()
+        raise KeyError(key)
+
+    def keys(self):
+        return AvcStreamFormat._keys
+
+    def as_dict(self):
+        return {key: self[key] for key in AvcStreamFormat._keys}
+
+# An index of formats over plugs of a device. It maps (direction, plug,
+# sampling rate, the number of channels, data type code) to formats and their
+# positions in the list of the plug, and answers queries for the plugs which
+# support a sampling rate with enough channels of a data type.
+class AvcStreamFormatIndex():
+    # Multi-bit linear audio, i.e. PCM.
+    pcm_code = 0x06
+
+    def __init__(self):
+        self._entries = {}
+        self._rows = {}
+        self._counts = {}
+
+    # The stream formats are in the layout of BebobNormal.stream_formats, i.e.
+    # plug type, direction, plug number and the list of formats. Plugs are
+    # identified by (plug type, plug number).
+    @staticmethod
+    def build(stream_formats):
+        index = AvcStreamFormatIndex()
+        for type, dir_plugs in stream_formats.items():
+            for direction, plugs in dir_plugs.items():
+                for num, fmts in enumerate(plugs):
+                    for i, fmt in enumerate(fmts):
+                        index.add(direction, (type, num), i, fmt)
+        return index
+
+    def add(self, direction, plug, index, fmt):
+        for code, channels in self._get_channels(fmt).items():
+            key = (direction, plug, fmt.sampling_rate, channels, code)
+            self._entries.setdefault(key, []).append((index, fmt))
+            row = (direction, fmt.sampling_rate, code)
+            self._rows.setdefault(row, []).append((channels, plug, index, fmt))
+            self._counts.pop(row, None)
+
+    # Returns a list of (index, format).
+    def lookup(self, direction, plug, rate, channels, code=pcm_code):
+        return list(self._entries.get((direction, plug, rate, channels, code),
+                                      ()))
+
+    # Returns a list of (channels, plug, index, format) with the number of
+    # channels at least the given one, in ascending order of it.
+    def find(self, direction, rate, min_channels=0, code=pcm_code):
+        row = (direction, rate, code)
+        if row not in self._rows:
+            return []
+        if row not in self._counts:
+            self._rows[row].sort(key=lambda entry: entry[0])
+            self._counts[row] = [entry[0] for entry in self._rows[row]]
+        pos = bisect_left(self._counts[row], min_channels)
+        return self._rows[row][pos:]
+
+    def get_plugs(self, direction, rate, min_channels=0, code=pcm_code):
+        plugs = []
+        for channels, plug, index, fmt in self.find(direction, rate,
+                                                    min_channels, code):
+            if plug not in plugs:
+                plugs.append(plug)
+        return plugs
+
+    # Returns bitmasks of supported sampling rates for plugs of the type, in
+    # the layout of AvcRateChange.get_capabilities().
+    def get_rate_masks(self, type='isoc'):
+        masks = {}
+        for direction, plug, rate, channels, code in self._entries:
+            if plug[0] != type or rate not in AvcConnection._sampling_rate_ids:
+                continue
+            plugs = masks.setdefault(direction, [])
+            if len(plugs) <= plug[1]:
+                plugs.extend([0] * (plug[1] + 1 - len(plugs)))
+            plugs[plug[1]] |= 1 << AvcConnection._sampling_rate_ids[rate]
+        return masks
+
+    @staticmethod
+    def _get_channels(fmt):
+        channels = {}
+        for code, count in fmt.formation:
+            channels[code] = channels.get(code, 0) + count
+        return channels
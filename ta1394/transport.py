@@ -0,0 +1,224 @@
+from errno import ETIMEDOUT
+from random import random
+from threading import Lock
+from time import monotonic
+from time import sleep
+from types import MethodType
+from weakref import WeakMethod
+from weakref import finalize
+
+# Which responses and errors are retried, and how long to wait. The minimum
+# gap between commands is learned per unit: it widens whenever the unit
+# needs a retry and narrows after a run of commands without retry. After
+# timeout, control commands are not sent again unless retry_control is set,
+# since the unit may have applied them already, e.g. relative change of
+# volume.
+class AvcRetryPolicy():
+    def __init__(self, retries=4, delay=0.01, max_delay=0.5, jitter=0.5,
+                 max_gap=0.2, decay=32, retry_control=False):
+        if retries < 0:
+            raise ValueError('Invalid argument for the number of retries')
+        if jitter < 0 or jitter > 1:
+            raise ValueError('Invalid argument for jitter')
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_gap = max_gap
+        self.decay = decay
+        self.retry_control = retry_control
+
+    # In transition is final and the command is not applied. Interim is
+    # never retried since the command is still pending; Hinawa waits for the
+    # final response by itself.
+    def is_retriable(self, params):
+        return params[0] == 0x0b
+
+    # Status and inquiry have no effect on the unit.
+    def is_resendable(self, cmd):
+        return cmd[0] in (0x01, 0x02, 0x04) or \
+               (self.retry_control and cmd[0] == 0x00)
+
+    # Hinawa reports timeout as GLib.Error with ETIMEDOUT.
+    def is_timeout(self, e):
+        return isinstance(e, TimeoutError) or \
+               getattr(e, 'code', None) == ETIMEDOUT
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.delay * (2 ** attempt))
+        return delay * (1 - self.jitter * random())
+
+    def widen(self, gap):
+        return min(self.max_gap, max(gap * 2, self.delay))
+
+    def narrow(self, gap):
+        gap /= 2
+        if gap < self.delay / 2:
+            gap = 0.0
+        return gap
+
+# An adapter to the way of FCP transaction for a unit. It is resolved once
+# per unit, then transact(frame) returns response for a command frame and
+# request(frame) does the same with the retry policy.
+class AvcTransport():
+    ctypes = {
+        0x00: 'control',
+        0x01: 'status',
+        0x02: 'specific-inquiry',
+        0x03: 'notify',
+        0x04: 'general-inquiry',
+    }
+
+    statuses = {
+        0x08: 'not-implemented',
+        0x09: 'accepted',
+        0x0a: 'rejected',
+        0x0b: 'in-transition',
+        0x0c: 'implemented/stable',
+        0x0d: 'changed',
+        0x0f: 'interim',
+    }
+
+    _status_messages = {
+        0x08: 'Not implemented',
+        0x0a: 'Rejected',
+        0x0b: 'In transition',
+    }
+
+    retry_policy = AvcRetryPolicy()
+
+    def __init__(self, transact):
+        if not callable(transact):
+            raise ValueError('Invalid argument for transaction')
+        self.transact = transact
+        self.gap = 0.0
+        self._last = 0.0
+        self._clean = 0
+        # Filled by AvcStatistics when enabled.
+        self.statistics = None
+        # Filled by AvcIdentityCache.
+        self.guid = None
+        self.guid_probed = False
+        # Filled by AvcCcmGraph.
+        self.ccm_graph = None
+        # Filled by AvcAudioCache when enabled.
+        self.audio_cache = None
+        # Filled by AvcPipeline.get().
+        self.pipeline = None
+        self._lock = Lock()
+
+    # Transact with the retry policy, then return the last response. Set
+    # retry_policy to None to disable it for the unit. FCP allows one
+    # outstanding transaction per node, thus requests from threads, e.g.
+    # the worker of AvcPipeline, are serialized.
+    def request(self, cmd):
+        with self._lock:
+            return self._request(cmd)
+
+    def _request(self, cmd):
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            if self.gap > 0:
+                wait = self._last + self.gap - monotonic()
+                if wait > 0:
+                    sleep(wait)
+            try:
+                params = self.transact(cmd)
+            except Exception as e:
+                if policy is None or attempt >= policy.retries or \
+                   not policy.is_timeout(e) or \
+                   not policy.is_resendable(cmd):
+                    raise
+                params = None
+            self._last = monotonic()
+            if policy is None:
+                return params
+            if params is not None and not policy.is_retriable(params):
+                if attempt == 0:
+                    self._clean += 1
+                    if self._clean >= policy.decay:
+                        self.gap = policy.narrow(self.gap)
+                        self._clean = 0
+                return params
+            self.gap = policy.widen(self.gap)
+            self._clean = 0
+            if attempt >= policy.retries:
+                return params
+            sleep(policy.backoff(attempt))
+            attempt += 1
+
+    # Hinawa.SndUnit has fcp_transact() and Hinawa.FwFcp has transact(). Any
+    # other object with one of them is also available, as well as a callable
+    # which takes a command frame and returns a response frame.
+    @staticmethod
+    def bind(unit):
+        if isinstance(unit, AvcTransport):
+            return unit
+        transport = getattr(unit, '_avc_transport', None)
+        if transport is not None:
+            return transport
+        with AvcTransport._bind_lock:
+            key = AvcTransport._get_key(unit)
+            transport = AvcTransport._transports.get(key)
+            if transport is not None:
+                return transport
+            if hasattr(unit, 'fcp_transact'):
+                transport = AvcTransport(unit.fcp_transact)
+            elif hasattr(unit, 'transact'):
+                transport = AvcTransport(unit.transact)
+            elif callable(unit):
+                transport = AvcTransport(unit)
+            else:
+                raise ValueError('Invalid argument for SndUnit')
+            # Keep it in the unit so that it lives as long as the unit.
+            try:
+                unit._avc_transport = transport
+            except AttributeError:
+                AvcTransport._register(unit, key, transport)
+        return transport
+
+    # Units which don't take attributes, e.g. bound methods, keep their
+    # transports here while the object behind them is alive. Each access to
+    # a method gives a new bound method, thus it is identified by the object
+    # and the name of the method. The transport refers to the object weakly
+    # so that the entry doesn't keep it alive.
+    _transports = {}
+    _bind_lock = Lock()
+
+    @staticmethod
+    def _get_key(unit):
+        owner = getattr(unit, '__self__', None)
+        if owner is not None:
+            return (id(owner), getattr(unit, '__name__', None))
+        return (id(unit), None)
+
+    @staticmethod
+    def _register(unit, key, transport):
+        owner = getattr(unit, '__self__', unit)
+        if not isinstance(transport.transact, MethodType):
+            raise ValueError('Invalid argument for SndUnit')
+        try:
+            ref = WeakMethod(transport.transact)
+            finalize(owner, AvcTransport._transports.pop, key, None)
+        except TypeError:
+            raise ValueError('Invalid argument for SndUnit')
+        def transact(cmd):
+            func = ref()
+            if func is None:
+                raise RuntimeError('Unit is already released')
+            return func(cmd)
+        transport.transact = transact
+        AvcTransport._transports[key] = transport
+
+    @staticmethod
+    def decode_ctype(frame):
+        return AvcTransport.ctypes.get(frame[0], 'reserved')
+
+    @staticmethod
+    def decode_status(frame):
+        return AvcTransport.statuses.get(frame[0], 'reserved')
+
+    @staticmethod
+    def status_message(frame):
+        return AvcTransport._status_messages.get(frame[0], 'Unknown status')